@@ -2,6 +2,7 @@ import heapq
 import time
 from typing import Dict, List, Optional
 
+from geometry import static_geometry
 from gt import Food, Map, Snake, SnakeBrain, Vec3d
 
 
@@ -23,14 +24,16 @@ def a_star(
 ):
     ATTRACTOR = SIZE / 2
 
-    # Convert lists to sets for quick lookups
-    fence_set = set(fences) - {start, goal}
+    # `fences` is the static fence set of the round, shared, never copied
+    fence_set = fences if isinstance(fences, (set, frozenset)) else set(fences)
+    ends = {start, goal}
 
     # For simplicity, assume enemies is a list of EnemySnake objects, each with geometry as a list of Vec3d
     # Flatten enemy positions into a set
-    enemy_positions = {seg for e in enemies for seg in e.geometry} - {start, goal}
+    enemy_positions = {seg for e in enemies for seg in e.geometry} - ends
 
-    bad_cells = fence_set | enemy_positions
+    def bad(cell):
+        return (cell in fence_set and cell not in ends) or cell in enemy_positions
 
     # Priority queue for frontier
     # Each entry: (f_cost, g_cost, current_position)
@@ -64,12 +67,12 @@ def a_star(
         for nxt in neighbors:
             if not in_bounds(nxt, SIZE):
                 continue
-            if nxt in fence_set or nxt in enemy_positions:
+            if bad(nxt):
                 continue
 
             # cost of moving to next cell is less if it is closer to the center
             direction = nxt - current
-            dangerous_path = (nxt + direction) in bad_cells
+            dangerous_path = bad(nxt + direction)
 
             center_cost = 2 * ATTRACTOR.distance(nxt) / SIZE.len()
             cost = 1
@@ -91,7 +94,7 @@ def a_star(
 def find_path(map: Map, start: Vec3d, goal: Vec3d, timeout: float):
     # Example usage:
     SIZE = map.size
-    fences = map.fences
+    fences = static_geometry(map).fence_set
     enemies = map.snakes + map.enemies
 
     return a_star(start, goal, SIZE, fences, enemies, timeout)
@@ -100,7 +103,7 @@ def find_path(map: Map, start: Vec3d, goal: Vec3d, timeout: float):
 def find_path_brain(map: Map, snake: Snake, goal: Vec3d, timeout: float, label: str):
     # Example usage:
     SIZE = map.size
-    fences = map.fences
+    fences = static_geometry(map).fence_set
     enemies = map.snakes + map.enemies
 
     if not snake.geometry:
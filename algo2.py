@@ -2,10 +2,11 @@ import heapq
 import time
 from typing import Dict, List, Optional, Tuple
 
+from geometry import static_geometry
 from gt import Food, Map, Snake, SnakeBrain, Vec3d
 
 
-def is_valid_cell(pos: Vec3d, game_map: Map) -> bool:
+def is_valid_cell(pos: Vec3d, game_map: Map, fence_set=None) -> bool:
     # Basic checks
     if not (0 <= pos.x < game_map.size.x):
         return False
@@ -13,7 +14,9 @@ def is_valid_cell(pos: Vec3d, game_map: Map) -> bool:
         return False
     if not (0 <= pos.z < game_map.size.z):
         return False
-    if pos in game_map.fences:
+    if fence_set is None:
+        fence_set = static_geometry(game_map).fence_set
+    if pos in fence_set:
         return False
     # Potentially avoid snake bodies, enemies, etc.
     return True
@@ -50,7 +53,9 @@ def a_star_multi_goal(
     # Convert goal_positions to a set for quick membership checks
     goal_set = set(goal_positions)
 
-    bad_cells = set(game_map.fences)
+    # Static fences are shared for the round, only moving things are collected
+    fence_set = static_geometry(game_map).fence_set
+    bad_cells = set()
     for snake in game_map.snakes:
         bad_cells.update(snake.geometry)
 
@@ -99,7 +104,7 @@ def a_star_multi_goal(
         neighbors = sorted(neighbors, key=lambda x: x.cos_to(ATTRACTOR))
 
         for neighbor in current.neighbors():
-            if not is_valid_cell(neighbor, game_map):
+            if not is_valid_cell(neighbor, game_map, fence_set):
                 continue
 
             if neighbor in bad_cells:
@@ -109,7 +114,8 @@ def a_star_multi_goal(
                 continue
 
             direction = neighbor - current
-            dangerous_path = (neighbor + direction) in bad_cells
+            ahead = neighbor + direction
+            dangerous_path = ahead in bad_cells or ahead in fence_set
 
             center_cost = (
                 2 * min(45, ATTRACTOR.distance(neighbor)) / game_map.size.len()
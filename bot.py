@@ -0,0 +1,119 @@
+"""
+Headless bot runner.
+
+Plays a live round with recording and logging only: no window, and no
+graphics module (imgui, pygame, OpenGL) is ever imported.
+
+usage:
+python bot.py --aio --hedge --gc_mode
+"""
+
+from time import perf_counter
+
+# Before the other imports, they are part of the startup time
+STARTED = perf_counter()
+
+import resource  # noqa: E402
+import sys  # noqa: E402
+from logging import basicConfig, getLogger  # noqa: E402
+from os import environ  # noqa: E402
+
+from fire import Fire  # noqa: E402
+
+from client import ApiClient  # noqa: E402
+from gameloop import AsyncGameloop, Gameloop  # noqa: E402
+from util.rounds import wait_round  # noqa: E402
+
+basicConfig(
+    level="INFO",
+    format="[%(levelname)s][%(name)s] %(message)s",
+)
+
+logger = getLogger(__name__)
+
+GRAPHICS = ("imgui", "pygame", "OpenGL")
+
+
+def rss_mb() -> float:
+    # Current RSS from /proc, peak RSS where there is no /proc
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def report_startup(stage: str):
+    loaded = [m for m in GRAPHICS if m in sys.modules]
+    if loaded:
+        logger.warning(f"🖼️ Graphics modules loaded: {', '.join(loaded)}")
+
+    elapsed = perf_counter() - STARTED
+    logger.info(f"⏱️ {stage}: {elapsed * 1000:.0f}ms, RSS {rss_mb():.1f}MB")
+
+
+def status_listener(every: int):
+    def listener(raw, world):
+        if world.turn % every == 0:
+            logger.info(
+                f"🐍 Turn {world.turn}, points {world.points}, "
+                f"snakes {len(world.snakes)}, RSS {rss_mb():.1f}MB"
+            )
+
+    return listener
+
+
+def main(
+    *,
+    aio: bool = False,
+    hedge: bool = False,
+    columnar: bool = False,
+    gc_mode: bool = False,
+    max_turns: int = None,
+    keyframe_every: int = 100,
+    lead: float = 3.0,
+    status_every: int = 50,
+    compression: str = None,
+    flight: bool = False,
+):
+    """
+    :param lead: seconds before the round start to get ready
+    :param status_every: turns between status log lines
+    :param compression: record "gzip", "zstd" or "columnar" replays
+    :param flight: record every decision next to the replay, see `flight`
+    """
+    report_startup("Imports")
+
+    api = ApiClient("prod", hedge=hedge)
+    # Connections are warmed in the lead window, not after the start
+    active = wait_round(api, lead, ready=api.warmup)
+
+    name = active["name"]
+    print(f"🚀 Playing round: {name}")
+
+    gameloop_class = AsyncGameloop if aio else Gameloop
+    gameloop = gameloop_class(
+        game_name=f"{name}-" + environ.get("USER", "dashik"),
+        columnar=columnar,
+        history=dict(max_turns=max_turns, keyframe_every=keyframe_every),
+        gc_mode=gc_mode,
+        compression=compression,
+        flight=flight,
+        client=api,
+    )
+    gameloop.autopilot = True
+    gameloop.world_builder.listeners.append(status_listener(status_every))
+
+    report_startup("Ready")
+
+    try:
+        gameloop.loop()
+    except KeyboardInterrupt:
+        gameloop.running = False
+
+    logger.info(f"🏁 Round {name} done, overruns {gameloop.scheduler.total_overruns}")
+
+
+if __name__ == "__main__":
+    Fire(main)
@@ -1,18 +1,30 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from copy import copy
 from functools import wraps
 from logging import basicConfig, getLogger
 from os import environ
+from time import perf_counter
 from typing import Literal
 
 import httpx
 from dotenv import load_dotenv
 from fire import Fire
 
+from util.budget import percentile
+from util.itypes import TIMERS
+
 load_dotenv()
 
 TEST = "https://games-test.datsteam.dev/"
 PROD = "https://games.datsteam.dev/"
 
-KEY = environ["DAD_TOKEN"]
+
+def auth_token() -> str:
+    # Read on first request, importing the client needs no token
+    return environ["DAD_TOKEN"]
 
 
 basicConfig(
@@ -33,41 +45,192 @@ class DadAuth(httpx.Auth):
         yield request
 
 
+class RequestTrace:
+    """
+    Per request timings from the httpx `trace` extension.
+
+    connect - TCP + TLS setup, zero on a reused keep-alive connection
+    ttfb    - request sent -> response headers received
+    body    - response headers -> body received
+
+    With a `deadline` it also enforces it for the whole call: httpx
+    timeouts apply to every phase (connect, write, read) on its own, so
+    before each phase the timeouts of the request shrink to what is left,
+    and a phase that starts or ends past the deadline fails the call.
+    """
+
+    def __init__(self, logger, deadline: float = None, timeouts: dict = None):
+        self.logger = logger
+        self.stamps = {}
+
+        self.deadline = deadline
+        self.timeouts = timeouts
+
+    def __call__(self, event: str, info: dict):
+        now = perf_counter()
+        # "http11.receive_response_headers.complete" -> without the protocol
+        self.stamps[event.split(".", 1)[-1]] = now
+
+        # Closing the connection after a received answer does not count
+        if self.deadline is None or "response_closed" in event:
+            return
+
+        left = self.deadline - now
+        if left <= 0:
+            raise httpx.TimeoutException(f"deadline passed at {event}")
+        if event.endswith(".started") and self.timeouts is not None:
+            # httpcore reads the timeouts of the request before every phase
+            for phase in self.timeouts:
+                self.timeouts[phase] = left
+
+    async def atrace(self, event: str, info: dict):
+        self(event, info)
+
+    def span(self, start: str, end: str) -> float:
+        if start not in self.stamps or end not in self.stamps:
+            return 0.0
+        return self.stamps[end] - self.stamps[start]
+
+    def report(self, method, url):
+        connect = self.span("connect_tcp.started", "connect_tcp.complete")
+        connect += self.span("start_tls.started", "start_tls.complete")
+
+        send = "send_request_headers.started"
+        head = "receive_response_headers.complete"
+        body = "receive_response_body.complete"
+
+        timings = {
+            "net connect": connect,
+            "net ttfb": self.span(send, head),
+            "net body": self.span(head, body),
+        }
+        TIMERS.update(timings)
+
+        self.logger.debug(
+            f"⏱️ {method} /{url} "
+            + " ".join(f"{k}={v*1000:.1f}ms" for k, v in timings.items())
+        )
+        return timings
+
+
+class Hedging:
+    """
+    Hedged request settings and stats.
+
+    A duplicate request goes out when the first one is slower than
+    the `quantile` of recent calls, the first answer wins.
+    """
+
+    def __init__(self, quantile=0.9, window=200, minimum=0.05):
+        self.quantile = quantile
+        self.minimum = minimum
+        self.latency = deque(maxlen=window)
+
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+
+    @property
+    def threshold(self) -> float:
+        if len(self.latency) < 10:
+            return None
+        return max(self.minimum, percentile(self.latency, self.quantile))
+
+    def observe(self, seconds: float):
+        self.calls += 1
+        self.latency.append(seconds)
+
+    def __str__(self):
+        return f"{self.fired} fired, {self.won} won of {self.calls}"
+
+
 class ApiClient:
-    def __init__(self, name: Literal["test", "prod"]):
+    client_class = httpx.Client
+
+    def __init__(
+        self,
+        name: Literal["test", "prod"],
+        *,
+        http2=False,
+        pool=4,
+        keepalive=60.0,
+        timeout=httpx.Timeout(2.0, connect=1.0),
+        hedge=False,
+        token: str = None,
+    ):
+        """
+        :param token: account token, `DAD_TOKEN` from the environment if None
+        """
         self.name = name
+        self.token = token
         self.base = PROD if name == "prod" else TEST
         logger_name = __name__ + "." + name
         self.logger = getLogger(logger_name)
 
-        self._client = httpx.Client(
-            # auth=DadAuth(KEY),
+        self.pool = pool
+        self.hedging = Hedging() if hedge else None
+
+        self._client = self.client_class(
+            # auth=DadAuth(auth_token()),
             http1=True,
-            http2=False,
+            http2=http2,
             base_url=self.base,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=pool,
+                max_keepalive_connections=pool,
+                keepalive_expiry=keepalive,
+            ),
         )
 
+    def _prepare(self, kwargs):
+        kwargs.setdefault(
+            "headers",
+            {
+                "Accept-Encoding": "gzip, deflate",
+                "X-Auth-Token": self.token or auth_token(),
+            },
+        )
+
+        # `deadline` - `perf_counter()` time the whole call must end by,
+        # instead of the client default timeouts
+        deadline = kwargs.pop("deadline", None)
+        if deadline is not None:
+            left = deadline - perf_counter()
+            if left <= 0:
+                raise httpx.TimeoutException("deadline passed before the request")
+            kwargs["timeout"] = httpx.Timeout(left)
+
+        return kwargs, deadline
+
+    def _build(self, method, url, kwargs) -> tuple[httpx.Request, RequestTrace]:
+        kwargs, deadline = self._prepare(kwargs)
+        request = self._client.build_request(method, url, **kwargs)
+
+        trace = RequestTrace(self.logger, deadline, request.extensions.get("timeout"))
+        request.extensions["trace"] = trace
+        return request, trace
+
     @wraps(httpx.Client.request)
-    def _request(self, method, url, **kwargs):
+    def _request(self, method, url, raw=False, **kwargs):
         """
         url without base - 'api/v1/games'
         httpx.request wrapper
 
-        :return: response.json()
+        :return: response.json(), or response bytes if `raw`
         """
         try:
-            kwargs.setdefault(
-                "headers",
-                {
-                    "Accept-Encoding": "gzip, deflate",
-                    "X-Auth-Token": KEY,
-                },
-            )
-            response = self._client.request(method, url, **kwargs)
+            request, trace = self._build(method, url, kwargs)
+            response = self._client.send(request)
         except Exception as e:
             self.logger.error(f"request error: {e}")
             raise
 
+        trace.report(method, url)
+
+        return self._response(response, method, url, raw)
+
+    def _response(self, response, method, url, raw=False):
         self.logger.debug(f"{response.status_code} {method} /{url} ")
 
         if response.status_code >= 300:
@@ -75,6 +238,9 @@ class ApiClient:
             self.logger.info(response.request.headers)
             raise Exception(response.json())
 
+        if raw:
+            return response.content
+
         return response.json()
 
     ######################################
@@ -122,10 +288,177 @@ class ApiClient:
         # rounds["rounds"] = [r for r in rounds["rounds"] if r["status"] != "ended"]
         return rounds
 
-    def world(self, commands=None):
+    def world(self, commands=None, deadline=None, raw=False):
+        """
+        :param deadline: `perf_counter()` time to give up at, None - client timeouts
+        :param raw: return response bytes, see `decode.decode_map`
+        """
+        if commands is None:
+            commands = {"snakes": []}
+
+        def move():
+            return self.post(
+                "play/snake3d/player/move", json=commands, deadline=deadline, raw=raw
+            )
+
+        if self.hedging:
+            # Commands are idempotent within a turn, sending them twice is safe
+            return self._hedged(move)
+
+        return move()
+
+    @staticmethod
+    def _spawn(call) -> Future:
+        """
+        A thread per attempt: the loser of a race keeps running until its
+        deadline, in a shared pool it would hold up the next turn's call.
+        """
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(call())
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="hedge", daemon=True).start()
+        return future
+
+    def _hedged(self, call):
+        start = perf_counter()
+        first = self._spawn(call)
+        pending = {first}
+
+        done, _ = wait(pending, timeout=self.hedging.threshold)
+        if not done:
+            self.hedging.fired += 1
+            pending.add(self._spawn(call))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() and pending:
+                    continue
+
+                if future is not first:
+                    self.hedging.won += 1
+
+                self.hedging.observe(perf_counter() - start)
+                return future.result()
+
+    def session(self, token: str) -> "ApiClient":
+        """
+        Same connection pool, another account.
+
+        usage:
+        second = api.session(environ["DAD_TOKEN_2"])
+        """
+        other = copy(self)
+        other.token = token
+        other.hedging = Hedging() if self.hedging else None
+        return other
+
+    def warmup(self, connections=None):
+        """
+        Open keep-alive connections before the round starts,
+        so the first `world()` does not pay for DNS, TCP and TLS.
+        """
+        connections = connections or self.pool
+
+        start = perf_counter()
+        with ThreadPoolExecutor(connections) as pool:
+            list(pool.map(lambda _: self.rounds(), range(connections)))
+
+        self.logger.info(
+            f"🔥 {connections} connections warmed in {perf_counter() - start:.2f}s"
+        )
+
+
+class AsyncApiClient(ApiClient):
+    """
+    Same api on top of `httpx.AsyncClient`.
+
+    Use it from one event loop only, sessions share it through `session`.
+    """
+
+    client_class = httpx.AsyncClient
+
+    async def _request(self, method, url, raw=False, **kwargs):
+        try:
+            request, trace = self._build(method, url, kwargs)
+            request.extensions["trace"] = trace.atrace
+            response = await self._client.send(request)
+        except Exception as e:
+            self.logger.error(f"request error: {e}")
+            raise
+
+        trace.report(method, url)
+
+        return self._response(response, method, url, raw)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request("PUT", url, **kwargs)
+
+    async def request(self, method, url, **kwargs):
+        return await self._request(method, url, **kwargs)
+
+    async def rounds(self):
+        return await self.get("rounds/snake3d/")
+
+    async def world(self, commands=None, deadline=None, raw=False):
         if commands is None:
             commands = {"snakes": []}
-        return self.post("play/snake3d/player/move", json=commands)
+
+        def move():
+            return self.post(
+                "play/snake3d/player/move", json=commands, deadline=deadline, raw=raw
+            )
+
+        if self.hedging:
+            return await self._hedged(move)
+
+        return await move()
+
+    async def _hedged(self, call):
+        start = perf_counter()
+        first = asyncio.ensure_future(call())
+        pending = {first}
+
+        done, _ = await asyncio.wait(pending, timeout=self.hedging.threshold)
+        if not done:
+            self.hedging.fired += 1
+            pending.add(asyncio.ensure_future(call()))
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() and pending:
+                        continue
+
+                    if task is not first:
+                        self.hedging.won += 1
+
+                    self.hedging.observe(perf_counter() - start)
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def warmup(self, connections=None):
+        connections = connections or self.pool
+        await asyncio.gather(*(self.rounds() for _ in range(connections)))
+
+    async def aclose(self):
+        await self._client.aclose()
 
 
 if __name__ == "__main__":
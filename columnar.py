@@ -0,0 +1,395 @@
+"""
+Columnar, array backed world.
+
+Same data as `gt.Map`, but every list of points is a numpy array:
+
+- fences            (N, 3) int16
+- food              parallel arrays of coordinates, points and type codes,
+                    golden and suspicious are bit flags, a cell can be both
+- snakes / enemies  one flat (K, 3) coordinate buffer + offsets,
+                    geometry of snake `i` is `xyz[offsets[i]:offsets[i + 1]]`
+
+Attributes of `Map` (`fences`, `food`, `snakes`, ...) are still there as
+lazily built compatibility views, so drawing and the algos keep working
+while they migrate to the columns.
+"""
+
+import json
+from functools import cached_property
+
+import numpy as np
+
+import decode
+from gt import EnemySnake, Food, Map, Snake, Vec3d
+
+FOOD_TYPES = ("normal", "golden", "suspicious")
+FOOD_CODE = {name: code for code, name in enumerate(FOOD_TYPES)}
+GOLDEN, SUSPICIOUS = FOOD_CODE["golden"], FOOD_CODE["suspicious"]
+
+# By type code, golden and suspicious flags combined
+FOOD_NAMES = (*FOOD_TYPES, "golden+suspicious")
+# Type of the `Food` item, golden wins as in `WorldModel`
+FOOD_TAGS = (*FOOD_TYPES, "golden")
+
+COORD = np.int16
+
+
+def _points(points) -> np.ndarray:
+    return np.array(points, dtype=COORD).reshape(-1, 3)
+
+
+def _offsets(geometries) -> tuple[np.ndarray, np.ndarray]:
+    offsets = np.zeros(len(geometries) + 1, dtype=np.int32)
+    np.cumsum([len(g) for g in geometries], out=offsets[1:])
+    xyz = _points([p for g in geometries for p in g])
+    return offsets, xyz
+
+
+def _vecs(xyz: np.ndarray) -> list[Vec3d]:
+    return [Vec3d(*p) for p in xyz.tolist()]
+
+
+class ColumnarMap:
+    def __init__(
+        self,
+        *,
+        size: Vec3d,
+        points: int,
+        name: str,
+        turn: int,
+        tick_remain_ms: int,
+        revive_timeout: int,
+        fence_xyz: np.ndarray,
+        food_xyz: np.ndarray,
+        food_points: np.ndarray,
+        food_type: np.ndarray,
+        food_listed: np.ndarray,
+        snake_ids: list[str],
+        snake_direction: np.ndarray,
+        snake_old_direction: np.ndarray,
+        snake_deaths: np.ndarray,
+        snake_status: list[str],
+        snake_revive: list,
+        snake_offsets: np.ndarray,
+        snake_xyz: np.ndarray,
+        enemy_status: list[str],
+        enemy_kills: np.ndarray,
+        enemy_offsets: np.ndarray,
+        enemy_xyz: np.ndarray,
+    ):
+        self.size = size
+        self.points = points
+        self.name = name
+        self.turn = turn
+        self.tick_remain_ms = tick_remain_ms
+        self.revive_timeout = revive_timeout
+
+        self.fence_xyz = fence_xyz
+
+        self.food_xyz = food_xyz
+        self.food_points = food_points
+        self.food_type = food_type
+        # False for golden/suspicious items missing from the server food list
+        self.food_listed = food_listed
+
+        self.snake_ids = snake_ids
+        self.snake_direction = snake_direction
+        self.snake_old_direction = snake_old_direction
+        self.snake_deaths = snake_deaths
+        self.snake_status = snake_status
+        self.snake_revive = snake_revive
+        self.snake_offsets = snake_offsets
+        self.snake_xyz = snake_xyz
+
+        self.enemy_status = enemy_status
+        self.enemy_kills = enemy_kills
+        self.enemy_offsets = enemy_offsets
+        self.enemy_xyz = enemy_xyz
+
+    @classmethod
+    def build(cls, *, food, golden, sus, snakes, enemies, fences, **scalars):
+        """
+        food    - [(coordinate, points)]
+        golden  - [coordinate]
+        sus     - [coordinate]
+        snakes  - [(id, direction, old_direction, geometry, deaths, status, revive)]
+        enemies - [(geometry, status, kills)]
+        """
+        index = {tuple(c): i for i, (c, _) in enumerate(food)}
+        types = np.zeros(len(food), dtype=np.uint8)
+        extra: dict[tuple, int] = {}
+
+        for code, items in ((GOLDEN, golden), (SUSPICIOUS, sus)):
+            for c in items:
+                c = tuple(c)
+                i = index.get(c)
+                if i is None:
+                    extra[c] = extra.get(c, 0) | code
+                else:
+                    types[i] |= code
+
+        food_xyz = _points([c for c, _ in food] + list(extra))
+        food_points = np.array([p for _, p in food] + [0] * len(extra), np.int32)
+        food_type = np.concatenate([types, np.array(list(extra.values()), np.uint8)])
+        food_listed = np.arange(len(food_xyz)) < len(food)
+
+        ids, direction, old, geometry, deaths, status, revive = (
+            zip(*snakes) if snakes else ([],) * 7
+        )
+        snake_offsets, snake_xyz = _offsets(geometry)
+
+        egeometry, estatus, kills = zip(*enemies) if enemies else ([],) * 3
+        enemy_offsets, enemy_xyz = _offsets(egeometry)
+
+        return cls(
+            **scalars,
+            fence_xyz=_points(fences),
+            food_xyz=food_xyz,
+            food_points=food_points,
+            food_type=food_type,
+            food_listed=food_listed,
+            snake_ids=list(ids),
+            snake_direction=_points(direction),
+            snake_old_direction=_points(old),
+            snake_deaths=np.array(deaths, dtype=np.int32),
+            snake_status=list(status),
+            snake_revive=list(revive),
+            snake_offsets=snake_offsets,
+            snake_xyz=snake_xyz,
+            enemy_status=list(estatus),
+            enemy_kills=np.array(kills, dtype=np.int32),
+            enemy_offsets=enemy_offsets,
+            enemy_xyz=enemy_xyz,
+        )
+
+    @classmethod
+    def from_map(cls, m: Map) -> "ColumnarMap":
+        return cls.build(
+            size=m.size,
+            points=m.points,
+            name=m.name,
+            turn=m.turn,
+            tick_remain_ms=m.tick_remain_ms,
+            revive_timeout=m.revive_timeout,
+            fences=m.fences,
+            food=[(f.coordinate, f.points) for f in m.food],
+            golden=[f.coordinate for f in m.golden],
+            sus=[f.coordinate for f in m.sus],
+            snakes=[
+                (
+                    s.id,
+                    s.direction,
+                    s.old_direction,
+                    s.geometry,
+                    s.death_count,
+                    s.status,
+                    s.revive_remain_ms,
+                )
+                for s in m.snakes
+            ],
+            enemies=[(e.geometry, e.status, e.kills) for e in m.enemies],
+        )
+
+    @classmethod
+    def from_wire(cls, w: "decode.WireWorld") -> "ColumnarMap":
+        special = w.special_food
+
+        return cls.build(
+            size=w.map_size,
+            points=w.points,
+            name=w.name,
+            turn=w.turn,
+            tick_remain_ms=w.tick_remain_ms,
+            revive_timeout=w.revive_timeout_sec,
+            fences=w.fences,
+            food=[(f.c, f.points) for f in w.food],
+            golden=special.golden if special else [],
+            sus=special.suspicious if special else [],
+            snakes=[
+                (
+                    s.id,
+                    s.direction,
+                    s.old_direction,
+                    s.geometry,
+                    s.death_count,
+                    s.status,
+                    s.revive_remain_ms,
+                )
+                for s in w.snakes
+            ],
+            enemies=[(e.geometry, e.status, e.kills) for e in w.enemies],
+        )
+
+    #####
+    # Vectorized queries
+    ###################################
+
+    def snake_geometry(self, i: int) -> np.ndarray:
+        return self.snake_xyz[self.snake_offsets[i] : self.snake_offsets[i + 1]]
+
+    def enemy_geometry(self, i: int) -> np.ndarray:
+        return self.enemy_xyz[self.enemy_offsets[i] : self.enemy_offsets[i + 1]]
+
+    def food_within(self, center: Vec3d, radius: int) -> np.ndarray:
+        """Indices of food with manhattan distance to `center` <= radius"""
+        distance = np.abs(self.food_xyz - np.array(center, dtype=COORD)).sum(axis=1)
+        return np.flatnonzero(distance <= radius)
+
+    def occupancy(self) -> np.ndarray:
+        """Boolean (x, y, z) grid of fences and all snake bodies"""
+        grid = np.zeros(tuple(self.size), dtype=bool)
+        for xyz in (self.fence_xyz, self.snake_xyz, self.enemy_xyz):
+            if len(xyz):
+                grid[xyz[:, 0], xyz[:, 1], xyz[:, 2]] = True
+        return grid
+
+    @property
+    def nbytes(self) -> int:
+        return sum(v.nbytes for v in vars(self).values() if isinstance(v, np.ndarray))
+
+    #####
+    # `gt.Map` compatibility view
+    ###################################
+
+    @cached_property
+    def fences(self) -> list[Vec3d]:
+        return _vecs(self.fence_xyz)
+
+    @cached_property
+    def _food(self) -> list[Food]:
+        coords = _vecs(self.food_xyz)
+        points = self.food_points.tolist()
+        types = self.food_type.tolist()
+        return [Food(c, p, FOOD_TAGS[t]) for c, p, t in zip(coords, points, types)]
+
+    @cached_property
+    def food(self) -> list[Food]:
+        return [f for f, listed in zip(self._food, self.food_listed) if listed]
+
+    def _special(self, code: int, type: str) -> list[Food]:
+        # Items of their own, as `gt.parse_special_food` makes them
+        xyz = self.food_xyz[(self.food_type & code) != 0]
+        return [Food(c, 0, type) for c in _vecs(xyz)]
+
+    @cached_property
+    def golden(self) -> list[Food]:
+        return self._special(GOLDEN, "golden")
+
+    @cached_property
+    def sus(self) -> list[Food]:
+        return self._special(SUSPICIOUS, "suspicious")
+
+    @cached_property
+    def snakes(self) -> list[Snake]:
+        return [
+            Snake(
+                id=self.snake_ids[i],
+                direction=Vec3d(*self.snake_direction[i].tolist()),
+                old_direction=Vec3d(*self.snake_old_direction[i].tolist()),
+                geometry=_vecs(self.snake_geometry(i)),
+                death_count=int(self.snake_deaths[i]),
+                status=self.snake_status[i],
+                revive_remain_ms=self.snake_revive[i],
+            )
+            for i in range(len(self.snake_ids))
+        ]
+
+    @cached_property
+    def enemies(self) -> list[EnemySnake]:
+        return [
+            EnemySnake(
+                geometry=_vecs(self.enemy_geometry(i)),
+                status=self.enemy_status[i],
+                kills=int(self.enemy_kills[i]),
+            )
+            for i in range(len(self.enemy_status))
+        ]
+
+    def to_map(self) -> Map:
+        return Map(
+            size=self.size,
+            points=self.points,
+            name=self.name,
+            fences=self.fences,
+            food=self.food,
+            golden=self.golden,
+            sus=self.sus,
+            enemies=self.enemies,
+            snakes=self.snakes,
+            turn=self.turn,
+            tick_remain_ms=self.tick_remain_ms,
+            revive_timeout=self.revive_timeout,
+        )
+
+
+def encode_wire(world: ColumnarMap) -> bytes:
+    """`ColumnarMap` -> server json, a line of a `.ljson` replay"""
+    xyz = world.food_xyz.tolist()
+    points = world.food_points.tolist()
+    types = world.food_type.tolist()
+    listed = world.food_listed.tolist()
+
+    snakes = []
+    for i, id in enumerate(world.snake_ids):
+        snake = {
+            "id": id,
+            "direction": world.snake_direction[i].tolist(),
+            "oldDirection": world.snake_old_direction[i].tolist(),
+            "geometry": world.snake_geometry(i).tolist(),
+            "deathCount": int(world.snake_deaths[i]),
+            "status": world.snake_status[i],
+        }
+        if world.snake_revive[i] is not None:
+            snake["reviveRemainMs"] = world.snake_revive[i]
+        snakes.append(snake)
+
+    wire = {
+        "mapSize": list(world.size),
+        "name": world.name,
+        "points": world.points,
+        "fences": world.fence_xyz.tolist(),
+        "snakes": snakes,
+        "enemies": [
+            {
+                "geometry": world.enemy_geometry(i).tolist(),
+                "status": status,
+                "kills": int(world.enemy_kills[i]),
+            }
+            for i, status in enumerate(world.enemy_status)
+        ],
+        "food": [{"c": c, "points": p} for c, p, l in zip(xyz, points, listed) if l],
+        "specialFood": {
+            "golden": [c for c, t in zip(xyz, types) if t & GOLDEN],
+            "suspicious": [c for c, t in zip(xyz, types) if t & SUSPICIOUS],
+        },
+        "turn": world.turn,
+        "reviveTimeoutSec": world.revive_timeout,
+        "tickRemainMs": world.tick_remain_ms,
+    }
+    return json.dumps(wire, separators=(",", ":")).encode()
+
+
+def decode_columnar(raw: bytes | str) -> ColumnarMap:
+    if decode.msgspec:
+        return ColumnarMap.from_wire(decode.decode_wire(raw))
+
+    return ColumnarMap.from_map(decode.decode_map(raw))
+
+
+def decoder(columnar: bool):
+    """
+    Payload -> world, `ColumnarMap` if `columnar` else `Map`.
+
+    Payloads are raw json, or worlds decoded already (`replaybin`
+    containers, `replayload`).
+    """
+    decode_raw = decode_columnar if columnar else decode.decode_map
+
+    def decode_payload(data) -> ColumnarMap | Map:
+        if isinstance(data, ColumnarMap):
+            return data if columnar else data.to_map()
+        if isinstance(data, Map):
+            return ColumnarMap.from_map(data) if columnar else data
+        return decode_raw(data)
+
+    return decode_payload
@@ -0,0 +1,239 @@
+"""
+Typed decoder, raw response bytes -> `Map`.
+
+Wire structs below mirror the server json, msgspec decodes the bytes
+straight into them (coordinates land in `Vec3d` int tuples), no
+intermediate dict tree is built. Without msgspec falls back to
+`json.loads` + `parse_map`.
+
+`LazyMap` keeps the payload and decodes the lists (fences, food,
+snakes, ...) only when they are first looked at, see `decode_lazy`.
+"""
+
+import json
+from functools import cached_property
+from typing import Optional
+
+from gt import (
+    EnemySnake,
+    Food,
+    Map,
+    Snake,
+    Vec3d,
+    parse_enemy_snake,
+    parse_food,
+    parse_map,
+    parse_snake,
+    parse_special_food,
+)
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+if msgspec:
+
+    class WireSnake(msgspec.Struct, rename="camel", kw_only=True):
+        id: str
+        direction: Vec3d
+        old_direction: Vec3d
+        geometry: list[Vec3d]
+        death_count: int
+        status: str
+        revive_remain_ms: Optional[int] = None
+
+    class WireEnemy(msgspec.Struct):
+        geometry: list[Vec3d]
+        status: str
+        kills: int
+
+    class WireFood(msgspec.Struct):
+        c: Vec3d
+        points: int
+
+    class WireSpecialFood(msgspec.Struct):
+        golden: list[Vec3d] = []
+        suspicious: list[Vec3d] = []
+
+    class WireWorld(msgspec.Struct, rename="camel", kw_only=True):
+        map_size: Vec3d
+        name: str
+        points: int
+        fences: list[Vec3d]
+        snakes: list[WireSnake]
+        enemies: list[WireEnemy]
+        food: list[WireFood]
+        special_food: Optional[WireSpecialFood] = None
+        turn: int
+        revive_timeout_sec: int
+        tick_remain_ms: int
+
+    _decoder = msgspec.json.Decoder(WireWorld)
+
+    class RawWorld(msgspec.Struct, rename="camel", kw_only=True):
+        """`WireWorld` with the lists left as raw json"""
+
+        map_size: Vec3d
+        name: str
+        points: int
+        fences: msgspec.Raw
+        snakes: msgspec.Raw
+        enemies: msgspec.Raw
+        food: msgspec.Raw
+        special_food: msgspec.Raw = msgspec.Raw(b"null")
+        turn: int
+        revive_timeout_sec: int
+        tick_remain_ms: int
+
+    _raw_decoder = msgspec.json.Decoder(RawWorld)
+    _field_decoders = {
+        "fences": msgspec.json.Decoder(list[Vec3d]),
+        "snakes": msgspec.json.Decoder(list[WireSnake]),
+        "enemies": msgspec.json.Decoder(list[WireEnemy]),
+        "food": msgspec.json.Decoder(list[WireFood]),
+        "special_food": msgspec.json.Decoder(Optional[WireSpecialFood]),
+    }
+
+
+def wire_to_map(w: "WireWorld") -> Map:
+    special = w.special_food
+
+    return Map(
+        size=w.map_size,
+        name=w.name,
+        points=w.points,
+        #
+        fences=w.fences,
+        #
+        food=[Food(f.c, f.points, "normal") for f in w.food],
+        golden=[Food(c, 0, "golden") for c in special.golden] if special else [],
+        sus=[Food(c, 0, "suspicious") for c in special.suspicious] if special else [],
+        #
+        turn=w.turn,
+        tick_remain_ms=w.tick_remain_ms,
+        revive_timeout=w.revive_timeout_sec,
+        #
+        snakes=[wire_snake(s) for s in w.snakes],
+        enemies=[EnemySnake(e.geometry, e.status, e.kills) for e in w.enemies],
+    )
+
+
+def wire_snake(s: "WireSnake") -> Snake:
+    return Snake(
+        id=s.id,
+        direction=s.direction,
+        old_direction=s.old_direction,
+        geometry=s.geometry,
+        death_count=s.death_count,
+        status=s.status,
+        revive_remain_ms=s.revive_remain_ms,
+    )
+
+
+def decode_wire(raw: bytes | str) -> "WireWorld":
+    return _decoder.decode(raw)
+
+
+def decode_map(raw: bytes | str) -> Map:
+    if msgspec:
+        return wire_to_map(decode_wire(raw))
+
+    return parse_map(json.loads(raw))
+
+
+class LazyMap(Map):
+    """
+    `Map` over an undecoded payload.
+
+    Scalars (turn, points, ...) are read right away, every list is
+    decoded on first access and cached on the instance. A world that is
+    never drawn or planned against costs its raw bytes only.
+
+    Food is tagged golden/suspicious from the special food of the same
+    turn, there is no `WorldModel` behind it.
+    """
+
+    def __init__(self, raw: bytes | str):
+        if msgspec:
+            self._data = _raw_decoder.decode(raw)
+            self.size = self._data.map_size
+            self.name = self._data.name
+            self.points = self._data.points
+            self.turn = self._data.turn
+            self.tick_remain_ms = self._data.tick_remain_ms
+            self.revive_timeout = self._data.revive_timeout_sec
+        else:
+            # No partial parsing in `json`, only the dataclasses are deferred
+            self._data = data = json.loads(raw)
+            self.size = Vec3d(*data["mapSize"])
+            self.name = data["name"]
+            self.points = data["points"]
+            self.turn = data["turn"]
+            self.tick_remain_ms = data["tickRemainMs"]
+            self.revive_timeout = data["reviveTimeoutSec"]
+
+    def _wire(self, name: str):
+        return _field_decoders[name].decode(getattr(self._data, name))
+
+    @cached_property
+    def fences(self) -> list[Vec3d]:
+        if msgspec:
+            return self._wire("fences")
+        return [Vec3d(*f) for f in self._data["fences"]]
+
+    @cached_property
+    def _special(self) -> tuple[list, list]:
+        if msgspec:
+            special = self._wire("special_food")
+            return (special.golden, special.suspicious) if special else ([], [])
+
+        special = self._data.get("specialFood") or {}
+        return special.get("golden", []), special.get("suspicious", [])
+
+    @cached_property
+    def golden(self) -> list[Food]:
+        return [parse_special_food(c, "golden") for c in self._special[0]]
+
+    @cached_property
+    def sus(self) -> list[Food]:
+        return [parse_special_food(c, "suspicious") for c in self._special[1]]
+
+    @cached_property
+    def food(self) -> list[Food]:
+        if msgspec:
+            food = [Food(f.c, f.points, "normal") for f in self._wire("food")]
+        else:
+            food = [parse_food(f) for f in self._data["food"]]
+
+        # Golden last, it wins a cell listed as both, as in `WorldModel`
+        special = {f.coordinate: f.type for f in self.sus + self.golden}
+        if special:
+            for f in food:
+                f.type = special.get(f.coordinate, "normal")
+        return food
+
+    @cached_property
+    def snakes(self) -> list[Snake]:
+        if msgspec:
+            return [wire_snake(s) for s in self._wire("snakes")]
+        return [parse_snake(s) for s in self._data["snakes"]]
+
+    @cached_property
+    def enemies(self) -> list[EnemySnake]:
+        if msgspec:
+            wire = self._wire("enemies")
+            return [EnemySnake(e.geometry, e.status, e.kills) for e in wire]
+        return [parse_enemy_snake(e) for e in self._data["enemies"]]
+
+    def decoded(self) -> list[str]:
+        """Lists decoded so far"""
+        return [name for name in LAZY_FIELDS if name in self.__dict__]
+
+
+LAZY_FIELDS = ("fences", "food", "golden", "sus", "snakes", "enemies")
+
+
+def decode_lazy(raw: bytes | str) -> LazyMap:
+    return LazyMap(raw)
@@ -0,0 +1,211 @@
+"""
+Decision flight recorder.
+
+The replay has what the server said, this log has what we did about it:
+one json line per planned turn with the budget, how long every planning
+stage took against its share, the paths and `thinks` of every snake and
+the banned targets. Written next to the replay by a `BackgroundWriter`,
+the planner hands over shallow copies, encoding happens on the writer
+thread.
+
+`data/<round>.ljson` -> `data/<round>.flight.ljson` (+ `.idx`)
+
+In replay mode `FlightLog` finds the log of the replay and the viewer
+overlays the recorded paths and the stage timings of the drawn turn.
+
+usage:
+python -m flight show data/round.ljson 1234
+python -m flight overruns data/round.ljson
+"""
+
+import json
+from logging import getLogger
+from pathlib import Path
+from time import perf_counter
+
+from fire import Fire
+
+from gt import Map, SnakeBrain, Vec3d
+from util.budget import TurnBudget
+from util.itypes import TIMERS
+from util.scribe import BackgroundWriter, LineSink
+from util.turnindex import TurnIndex
+
+logger = getLogger(__name__)
+
+# Gameloop timers worth keeping per turn
+TIMERS_KEPT = ("world_load", "world_request", "gameloop_sleep")
+
+
+def flight_path(replay) -> Path:
+    replay = Path(replay)
+    return replay.with_name(replay.name.split(".")[0] + ".flight.ljson")
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+def encode(entry: tuple) -> bytes:
+    turn, tick_remain_ms, budget, spent, stages, paths, banned, timers = entry
+    return json.dumps(
+        {
+            "turn": turn,
+            "tick": tick_remain_ms,
+            "budget": _ms(budget),
+            "spent": _ms(spent),
+            "stages": [
+                [owner, name, _ms(took), _ms(share)]
+                for owner, name, took, share in stages
+            ],
+            "snakes": [
+                {"id": id, "thinks": thinks, "direction": direction, "path": path}
+                for id, thinks, direction, path in paths
+            ],
+            "banned": banned,
+            "timers": {k: _ms(v) for k, v in timers.items()},
+        },
+        separators=(",", ":"),
+    ).encode()
+
+
+class FlightRecorder:
+    def __init__(self, replay, enabled=False):
+        self.path = flight_path(replay)
+        self.enabled = enabled
+        self.writer: BackgroundWriter = None
+
+    def record(self, world: Map, budget: TurnBudget, paths, banned):
+        """Right after planning, `paths` is the list the planner just built"""
+        if not self.enabled or world is None:
+            return
+
+        if self.writer is None:
+            logger.info(f"🛫 Flight recorder: {self.path}")
+            self.writer = BackgroundWriter(
+                self.path, LineSink(self.path), encode, fsync="never"
+            )
+
+        # The planner goes on with these, the writer gets copies
+        timers = {k: TIMERS[k] for k in TIMERS_KEPT if k in TIMERS}
+        stages = list(budget.stages)
+        paths = [(p.snake.id, p.thinks, p.direction, list(p.path)) for p in paths]
+        banned = list(banned)
+        spent = perf_counter() - budget.start
+        self.writer.write(
+            (
+                world.turn,
+                world.tick_remain_ms,
+                budget.deadline - budget.start,
+                spent,
+                stages,
+                paths,
+                banned,
+                timers,
+            )
+        )
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class FlightLog:
+    """Decisions of a recorded round, by turn"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.index = TurnIndex.open(path)
+        self.last: tuple[int, dict] = (None, None)
+
+    @classmethod
+    def find(cls, replay) -> "FlightLog":
+        """Log of `replay`, None when it was recorded without one"""
+        path = flight_path(replay)
+        if not path.is_file() or not path.stat().st_size:
+            return None
+        return cls(path)
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, turn: int) -> dict | None:
+        if self.last[0] == turn:
+            return self.last[1]
+
+        i = self.index.position(turn)
+        entry = None
+        if i < len(self.index) and self.index.rows[i]["turn"] == turn:
+            entry = json.loads(self.index.line(i))
+
+        self.last = (turn, entry)
+        return entry
+
+    def brains(self, world: Map) -> list[SnakeBrain]:
+        """Recorded paths of the turn, on the snakes of `world`"""
+        entry = self.get(world.turn)
+        if not entry:
+            return []
+
+        snakes = {s.id: s for s in world.snakes}
+        return [
+            SnakeBrain(
+                snake=snakes[s["id"]],
+                path=[Vec3d(*p) for p in s["path"]],
+                direction=Vec3d(*s["direction"]),
+                thinks=s["thinks"],
+            )
+            for s in entry["snakes"]
+            if s["id"] in snakes
+        ]
+
+    def close(self):
+        self.index.close()
+
+
+def overrun_stages(entry: dict) -> list[list]:
+    return [s for s in entry["stages"] if s[2] > s[3]]
+
+
+def show(replay, turn: int):
+    """Decisions of one turn"""
+    log = FlightLog.find(replay)
+    if log is None:
+        print(f"🥵 No flight log for {replay}")
+        return
+
+    entry = log.get(turn)
+    if entry is None:
+        print(f"🥵 Turn {turn} was not planned")
+        return
+
+    print(f"🛫 Turn {turn}: spent {entry['spent']}ms of {entry['budget']}ms")
+    for owner, name, took, share in entry["stages"]:
+        mark = "🔥" if took > share else "  "
+        print(f"{mark} {owner:>24} {name:>16} {took:>8}ms / {share}ms")
+    for snake in entry["snakes"]:
+        print(f"🐍 {snake['id'][:8]} {snake['thinks']}, {len(snake['path'])} cells")
+    print(f"🚫 Banned: {entry['banned']}")
+
+
+def overruns(replay):
+    """Turns where a stage used more than its share"""
+    log = FlightLog.find(replay)
+    if log is None:
+        print(f"🥵 No flight log for {replay}")
+        return
+
+    for i in range(len(log)):
+        entry = json.loads(log.index.line(i))
+        late = overrun_stages(entry)
+        if late or entry["spent"] > entry["budget"]:
+            spent, budget = entry["spent"], entry["budget"]
+            print(f"🔥 Turn {entry['turn']}: {spent}ms of {budget}ms")
+            for owner, name, took, share in late:
+                stage = owner if name == owner else f"{owner} {name}"
+                print(f"   {stage}: {took}ms / {share}ms")
+
+
+if __name__ == "__main__":
+    Fire({"show": show, "overruns": overruns})
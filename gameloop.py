@@ -1,4 +1,6 @@
+import asyncio
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from logging import getLogger
 from random import randint, shuffle
@@ -10,29 +12,66 @@ from algo2 import (
     calculate_surrounding_values,
     snake_ai_move_astar_multi,
 )
-from client import ApiClient
-from gt import Map, Snake, SnakeBrain, Vec3d, parse_map
+from client import ApiClient, AsyncApiClient
+from columnar import decoder
+from flight import FlightRecorder
+from geometry import GEOMETRY
+from gt import Map, Snake, SnakeBrain, SnakeNames, Vec3d
+from history import History, LazyHistory
+from replayload import ReplayLoader
+from util.budget import DeadlinePool, Scheduler, TurnBudget
+from util.clock import TickClock
+from util.gcmode import GcGuard
 from util.itypes import TIMERS, measure
 from util.scribe import Scribe
+from worldstate import WorldDiff, WorldModel
 
 api = ApiClient("prod")
 
 logger = getLogger(__name__)
 
+# Seconds between requests while there is no world at all yet
+NO_WORLD_RETRY = 0.1
+
 
 class WorldBuild:
-    def __init__(self, scribe: Scribe, replay: bool, init: Map, gl: "Gameloop"):
+    def __init__(
+        self,
+        scribe: Scribe,
+        replay: bool,
+        init: Map,
+        gl: "Gameloop",
+        history: dict = None,
+    ):
+        """
+        :param history: `History` options, memory caps
+        """
         self.replay = replay
         self.scribe = scribe
 
         if replay:
-            self.replay_data = scribe.replay_iterator()
+            self.replay_data = scribe.payloads()
 
         self.world = init
 
-        self.history: list[Map] = [init]
+        self.history = History(**(history or {}))
         self.gl = gl
 
+        self.decode = decoder(gl.columnar)
+
+        # (sent, received) of the latest successful request
+        self.exchange = None
+
+        self.model = WorldModel()
+        self.diff: WorldDiff = None
+
+        self.history.append(init, self.model.apply(init) if init else None)
+
+        # Undecoded payload of the latest pulled world
+        self.raw = None
+        # Called with (raw, world) for every world added to the history
+        self.listeners = []
+
     def pull_world(self, commands):
         if self.replay:
             return self._pull_replay()
@@ -42,7 +81,8 @@ class WorldBuild:
     def _pull_replay(self):
         try:
             data = next(self.replay_data)
-            return parse_map(data)
+            self.raw = data
+            return self.decode(data)
 
         except StopIteration:
             if self.gl.replay_loading:
@@ -51,54 +91,107 @@ class WorldBuild:
             return None
 
     def _pull_api(self, commands):
+        try:
+            sent = perf_counter()
+            data = self.gl.api.world(
+                self.outgoing(commands), self.gl.request_deadline(), raw=True
+            )
+            self.exchange = (sent, perf_counter())
+
+            return self.ingest(data)
+
+        except Exception as e:
+            logger.error("Error pulling world", e, exc_info=e)
+            return None
+
+    async def apull_world(self, aapi: AsyncApiClient, commands):
+        try:
+            sent = perf_counter()
+            data = await aapi.world(
+                self.outgoing(commands), self.gl.request_deadline(), raw=True
+            )
+            self.exchange = (sent, perf_counter())
+
+            return self.ingest(data)
+
+        except Exception as e:
+            logger.error("Error pulling world", e, exc_info=e)
+            return None
+
+    def outgoing(self, commands):
         commands = commands or []
 
         algo_commands = self.gl.collect_commands()
 
+        return {"snakes": algo_commands + commands}
+
+    def ingest(self, data: bytes):
+        self.raw = data
         try:
-            data = api.world({"snakes": algo_commands + commands})
+            world = self.decode(data)
+        except Exception:
+            # Recorded even when it does not decode
             self.scribe.dump_world(lambda: data)
+            raise
 
-            mp = parse_map(data)
+        # A columnar world goes into a container as it is, not decoded again
+        self.scribe.dump_world(lambda: data, world)
+        return world
 
-            return mp
+    def load_replay(self, workers=None):
+        """Fills the history with the whole replay at once, see `replayload`"""
+        loader = ReplayLoader(self.scribe, self.gl.columnar, workers=workers)
+        upd = self.gl.upd
+        upd.state = "Loading"
 
-        except Exception as e:
-            logger.error("Error pulling world", e, exc_info=e)
-            return None
+        for world in loader.worlds():
+            if not self.gl.running:
+                break
+
+            # Decoded already, listeners get the world itself
+            self.raw = world
+            self.push_world(world)
+            upd.turn, upd.loaded, upd.total = world.turn, loader.loaded, loader.total
+
+        self.replay_data = iter(())
+
+    def open_lazy(self):
+        """History over the undecoded replay, see `history.LazyHistory`"""
+        self.history = LazyHistory(self.scribe, cache_size=self.history.cache_size)
+        self.replay_data = iter(())
+
+        upd = self.gl.upd
+        upd.loaded = upd.total = len(self.history)
 
     def get_latest_world(self):
         return self.history[-1], len(self.history) - 1
 
     def load_world_state(self, commands):
-        world = self.pull_world(commands)
+        return self.push_world(self.pull_world(commands))
 
+    def push_world(self, world):
         if not world:
             return self.get_latest_world()[0]
 
+        if self.exchange:
+            self.gl.clock.observe(*self.exchange, world.turn, world.tick_remain_ms)
+
+        # One fence list per round instead of one per turn
+        GEOMETRY.intern(world)
+
         current = self.history[-1]
         combined = self.merge_world(current, world)
 
-        self.history.append(combined)
+        self.history.append(combined, self.diff)
+
+        for listener in self.listeners:
+            listener(self.raw, combined)
 
         return combined
 
     def merge_world(self, glob: Map, local: Map):
-        foodmap = {f.coordinate: f for f in local.food}
-
-        for item in local.sus:
-            if item.coordinate in foodmap:
-                foodmap[item.coordinate].type = "suspicious"
-
-        for item in local.golden:
-            if item.coordinate in foodmap:
-                foodmap[item.coordinate].type = "golden"
-
-        # m = deepcopy(glob.map)
-
-        # for item in local.map:
-        #     point = Vec2(**item)
-        #     m[point] = item
+        # Tags golden/suspicious food and keeps the indexes up to date
+        self.diff = self.model.apply(local)
 
         return local
 
@@ -107,10 +200,14 @@ class WorldBuild:
 class UpdateState:
     turn: int
     frame: int
-    state: Literal["Network", "Algorithm", "Command Send"]
+    state: Literal["Network", "Algorithm", "Command Send", "Loading"]
     timeout: int
     algo_for_turn: int
 
+    # Replay loading progress, `total` is None when unknown
+    loaded: int = 0
+    total: int = None
+
     @property
     def algo_done(self):
         return self.algo_for_turn == self.turn
@@ -123,26 +220,65 @@ class Gameloop:
         replay_file=None,
         game_name=None,
         upto=None,
+        columnar=False,
+        history: dict = None,
+        gc_mode=False,
+        start: int = None,
+        replay_workers: int = None,
+        client: ApiClient = None,
+        planner: DeadlinePool = None,
+        compression: str = None,
+        lazy: bool = False,
+        flight: bool = False,
     ):
+        """
+        :param client: api client of this session, the module `api` if None,
+            an `AsyncApiClient` is used as is by `aloop`
+        :param planner: planning workers shared with other sessions
+        :param compression: record "gzip", "zstd" or "columnar" replays
+        :param start: replay from this turn, see `util.turnindex`
+        :param replay_workers: replay decoding processes, None - one per core
+        :param lazy: replay turns are decoded only when looked at
+        :param flight: record decisions next to the replay, see `flight`
+        """
         if not replay_file and not game_name:
             raise ValueError("Either `replay_file` or `game_name` must be provided")
 
         self.running = True
         self.executor_thread = None
 
+        self.api = client or api
+        self.planner = planner
+
         self.replay = False
         self.replay_loading = True
         self.replay_simulate = None
+        self.replay_workers = replay_workers
+        self.lazy = lazy
+
+        # Keep worlds as `columnar.ColumnarMap`
+        self.columnar = columnar
 
         if game_name:
             self.replay = False
-            self.scribe = Scribe(f"data/{game_name}.ljson")
+            self.scribe = Scribe(
+                f"data/{game_name}.ljson", compression=compression
+            )
 
         if replay_file:
             self.replay = True
-            self.scribe = Scribe(replay_file, enabled=False, upto=upto)
-
-        self.world_builder = WorldBuild(self.scribe, self.replay, init, self)
+            self.scribe = Scribe(
+                replay_file, enabled=False, upto=upto, start=start
+            )
+
+        # Decisions of every planned turn, live rounds only
+        self.flight = FlightRecorder(
+            self.scribe.replay, enabled=flight and self.scribe.enabled
+        )
+
+        self.world_builder = WorldBuild(
+            self.scribe, self.replay, init, self, history=history
+        )
         self.world, _ = self.world_builder.get_latest_world()
 
         self.upd = UpdateState(0, 0, "Network", 0, 0)
@@ -151,9 +287,21 @@ class Gameloop:
 
         self.paths: list[SnakeBrain] = []
         self.banned = set()
+        self.names = SnakeNames()
 
         self.latest_targets = {}
 
+        self.scheduler = Scheduler()
+        self.clock = TickClock()
+        # Budget of the latest turn, the next request is timed by it
+        self.budget: TurnBudget = None
+
+        # Full collections only while sleeping, see `GcGuard`
+        self.gc = GcGuard(enabled=gc_mode)
+
+        # Planning switch, off means manual control only
+        self.autopilot = False
+
     def add_command(self, command):
         self.commands.append(command)
 
@@ -162,6 +310,21 @@ class Gameloop:
 
         return snakes
 
+    def request_deadline(self):
+        """
+        `perf_counter()` time the next world must arrive by: the planning
+        deadline of the turn the server is on when the request lands.
+        Deadlines of the turns after the latest budget are a tick apart.
+        """
+        if self.budget is None or not self.clock.tick:
+            return None
+
+        lands = perf_counter() + (self.clock.rtt or 0.0) / 2
+        deadline = self.budget.deadline
+        while deadline <= lands:
+            deadline += self.clock.tick
+        return deadline
+
     def ban_target(self, target: Vec3d):
         self.banned.add(target)
 
@@ -172,34 +335,25 @@ class Gameloop:
 
         return None
 
-    def algos2(self, world: Map, timeout):
+    def algos2(self, world: Map, budget: TurnBudget):
         brains = []
 
         snakes = list(filter(bool, world.snakes))
         shuffle(snakes)
         snakes = sorted(snakes, key=lambda x: x.id)
 
-        remaining_time = timeout
-
         best_food_cache = None
 
         targets = set()
 
-        for i, snake in enumerate(snakes):
-            snake_time = remaining_time / (len(snakes) - i)
-
+        for snake, sb in budget.split(snakes, key=lambda x: x.id):
             center = world.size / 2
             radius = center.len() / 2
             to_center = center - snake.head
             is_okraina = to_center.len() > 2 * radius / 3
             is_okraina = False
 
-            with measure(f"{snake.name} find_path"):
-                ai_start = perf_counter()
-
-                snake_time = remaining_time / (len(snakes) - i)
-                main_time = snake_time * 0.8
-
+            with measure(f"{self.names(snake)} find_path"):
                 if is_okraina:
                     brain = None
                 else:
@@ -207,21 +361,19 @@ class Gameloop:
                         v for k, v in self.latest_targets.items() if k != snake.id
                     }
 
-                    brain = snake_ai_move_astar_multi(
-                        world,
-                        snake,
-                        timeout=main_time,
-                        ignore=targets | self.banned | not_my_targets,
-                    )
+                    with sb.stage("astar_multi", share=0.8) as main_time:
+                        brain = snake_ai_move_astar_multi(
+                            world,
+                            snake,
+                            timeout=main_time,
+                            ignore=targets | self.banned | not_my_targets,
+                        )
                 if brain:
                     brains.append(brain)
-                    remaining_time -= perf_counter() - ai_start
                     targets.add(brain.path[-1])
                     self.latest_targets[snake.id] = brain.path[-1]
                     continue
 
-                snake_time -= perf_counter() - ai_start
-
                 if not best_food_cache and not is_okraina:
                     with measure("calculate_surroundings"):
                         best_food_cache = calculate_surrounding_values(world, radius=70)
@@ -251,17 +403,17 @@ class Gameloop:
                         vector_to_best = best.coordinate - snake.head
                         b = (snake.head + vector_to_best.normalize() * 10).round()
 
-                    brain = find_path_brain(
-                        world,
-                        snake,
-                        b,
-                        timeout=snake_time,
-                        label=f"BEST {best.points, best.type} {reachable=}",
-                    )
+                    with sb.stage("best") as snake_time:
+                        brain = find_path_brain(
+                            world,
+                            snake,
+                            b,
+                            timeout=snake_time,
+                            label=f"BEST {best.points, best.type} {reachable=}",
+                        )
                     if brain:
                         brains.append(brain)
                         targets.add(best.coordinate)
-                        remaining_time -= perf_counter() - ai_start
                         continue
 
                 center = world.size / 2
@@ -269,39 +421,63 @@ class Gameloop:
                 to_center_unit = to_center.normalize() * min(10, to_center.len() - 5)
                 if to_center.len() > world.size.len() / 16:
                     b = (snake.head + to_center_unit).round()
-                    brain = find_path_brain(
-                        world,
-                        snake,
-                        b,
-                        timeout=snake_time,
-                        label="RUN AWAY" if is_okraina else "CENTER",
-                    )
+                    with sb.stage("center") as snake_time:
+                        brain = find_path_brain(
+                            world,
+                            snake,
+                            b,
+                            timeout=snake_time,
+                            label="RUN AWAY" if is_okraina else "CENTER",
+                        )
                     if brain:
                         brains.append(brain)
-                        remaining_time -= perf_counter() - ai_start
                         continue
 
-                snake_time -= perf_counter() - ai_start
-
                 random = Vec3d(randint(3, 6), randint(3, 6), randint(3, 6))
                 b = snake.head + random
-                brain = find_path_brain(
-                    world, snake, b, timeout=snake_time, label="RANDOM"
-                )
+                with sb.stage("random") as snake_time:
+                    brain = find_path_brain(
+                        world, snake, b, timeout=snake_time, label="RANDOM"
+                    )
                 if brain:
                     brains.append(brain)
-                    remaining_time -= perf_counter() - ai_start
                     continue
 
         self.paths = brains
 
+    def think(self, world: Map, budget: TurnBudget):
+        if self.planner is None:
+            self.algos2(world, budget)
+        else:
+            # Shared workers, the session closest to its deadline goes first
+            job = self.planner.submit(budget.deadline, self.algos2, world, budget)
+            job.result()
+
+        self.flight.record(world, budget, self.paths, self.banned)
+
     def loop(self):
         logger.info("Gameloop started")
+        self.gc.start()
         try:
+            if self.replay and self.replay_loading:
+                with measure("replay_load"):
+                    if self.lazy:
+                        self.world_builder.open_lazy()
+                    else:
+                        self.world_builder.load_replay(self.replay_workers)
+
             while self.running:
+                self.gc.begin_turn()
+
                 with measure("world_load"):
                     self.upd.state = "Network"
-                    self.world = self.world_builder.load_world_state(self.commands)
+                    world = self.world_builder.load_world_state(self.commands)
+                    if world is None:
+                        # No init world and the first request failed, retry
+                        sleep(NO_WORLD_RETRY)
+                        continue
+
+                    self.world = world
                     self.commands = []
                     self.upd.turn = self.world.turn
                     self.upd.timeout = self.world.tick_remain_ms
@@ -322,17 +498,22 @@ class Gameloop:
                 if self.replay:
                     # just some reasonable value
                     timeout = 0.8
+                    budget = self.scheduler.turn(timeout * 1000, margin=0)
+                else:
+                    self.scheduler.observe_network(dt)
+                    budget = self.scheduler.turn(self.world.tick_remain_ms)
+                self.budget = budget
 
                 # Сначала идет в 1
                 # потом через мир, отправляет сразу команды
                 # (тут есть гибкость еще оттянуть время)
                 # потом идет в 2, спит, и по кругу
 
-                if not self.upd.algo_done and False:
+                if not self.upd.algo_done and self.autopilot:
                     # 1
                     with measure("algo"):
                         self.upd.state = "Algorithm"
-                        self.algos2(self.world, timeout=timeout * 0.95)
+                        self.think(self.world, budget)
                         self.upd.algo_for_turn = self.world.turn
 
                 else:
@@ -341,16 +522,177 @@ class Gameloop:
 
                     # 2
                     if not self.replay:
+                        wake = self.clock.wake_in(default=timeout + 0.09)
                         with measure("gameloop_sleep"):
-                            sleep(max(0, timeout + 0.09))
+                            sleep(max(0.0, wake - self.gc.idle(wake)))
 
         except Exception as e:
             logger.error("Gameloop error", exc_info=e)
         finally:
             self.running = False
+            self.gc.stop()
+            self.scribe.close()
+            self.flight.close()
             logger.info("Gameloop ended")
 
     def launch_async(self):
         self.executor_thread = threading.Thread(target=self.loop)
         self.executor_thread.start()
         return self
+
+
+class AsyncGameloop(Gameloop):
+    """
+    Gameloop on asyncio.
+
+    Planning runs in the executor, so the request for the next turn
+    goes out on time even when the current plan is still finishing.
+    A plan done before the tick boundary sends its commands right away,
+    a late one is not thrown away, its commands ride the next request.
+
+    Replays have no network to overlap, they use the plain loop.
+    """
+
+    def __init__(self, *args, workers=1, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="planner")
+
+    def loop(self):
+        if self.replay:
+            return super().loop()
+
+        try:
+            asyncio.run(self.aloop())
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def loop_together(gameloops: list["AsyncGameloop"], client: AsyncApiClient):
+        """
+        Live sessions on one event loop, an `AsyncApiClient` can not be
+        shared across loops. `client` is closed at the end, the sessions
+        got theirs from `client.session`.
+        """
+
+        async def run():
+            try:
+                await client.warmup()
+                await asyncio.gather(*(g.aloop() for g in gameloops))
+            finally:
+                await client.aclose()
+
+        try:
+            asyncio.run(run())
+        finally:
+            for gameloop in gameloops:
+                gameloop.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def request_world(self, aapi: AsyncApiClient):
+        commands, self.commands = self.commands, []
+
+        with measure("world_request"):
+            return await self.world_builder.apull_world(aapi, commands)
+
+    def plan(self, world: Map, budget: TurnBudget):
+        with measure("algo"):
+            self.algos2(world, budget)
+            self.upd.algo_for_turn = world.turn
+
+        self.flight.record(world, budget, self.paths, self.banned)
+
+    async def aloop(self):
+        logger.info("Async gameloop started")
+
+        # A shared client is warmed up and closed by its owner
+        owned = not isinstance(self.api, AsyncApiClient)
+        if owned:
+            aapi = AsyncApiClient(self.api.name, token=self.api.token)
+            aapi.hedging = self.api.hedging
+        else:
+            aapi = self.api
+        loop = asyncio.get_running_loop()
+        planning = None
+        # A plan whose commands have not been sent on their own yet
+        unsent = None
+
+        try:
+            if owned:
+                await aapi.warmup()
+            self.gc.start()
+            request = asyncio.create_task(self.request_world(aapi))
+
+            while self.running:
+                self.gc.begin_turn()
+
+                with measure("world_load"):
+                    self.upd.state = "Network"
+                    world = self.world_builder.push_world(await request)
+                    if world is None:
+                        # No init world and the first request failed, retry
+                        await asyncio.sleep(NO_WORLD_RETRY)
+                        request = asyncio.create_task(self.request_world(aapi))
+                        continue
+
+                    self.world = world
+                    self.upd.turn = self.world.turn
+                    self.upd.timeout = self.world.tick_remain_ms
+
+                dt = TIMERS["world_request"]
+                self.scheduler.observe_network(dt)
+                timeout = self.world.tick_remain_ms / 1000 - dt
+
+                budget = self.scheduler.turn(self.world.tick_remain_ms)
+                self.budget = budget
+
+                if self.autopilot and (planning is None or planning.done()):
+                    self.upd.state = "Algorithm"
+                    if self.planner is None:
+                        planning = loop.run_in_executor(
+                            self.executor, self.plan, self.world, budget
+                        )
+                    else:
+                        planning = asyncio.wrap_future(
+                            self.planner.submit(
+                                budget.deadline, self.plan, self.world, budget
+                            )
+                        )
+                    unsent = planning
+
+                wake = self.clock.wake_in(default=timeout + 0.09)
+                wake_at = perf_counter() + wake
+                if unsent is not None:
+                    with measure("plan_wait"):
+                        await asyncio.wait({unsent}, timeout=wake)
+
+                    # Done in time, its commands leave in this tick as in
+                    # the plain loop, a late plan rides the next request
+                    if unsent.done():
+                        unsent = None
+                        self.upd.state = "Command Send"
+                        world = await self.request_world(aapi)
+                        self.world = self.world_builder.push_world(world)
+                        wake = self.clock.wake_in(default=wake_at - perf_counter())
+
+                # A collection holds the GIL, never run it under the planner
+                if planning is None or planning.done():
+                    wake -= self.gc.idle(wake)
+
+                with measure("gameloop_sleep"):
+                    await asyncio.sleep(max(0.0, wake))
+
+                self.upd.state = "Command Send"
+                request = asyncio.create_task(self.request_world(aapi))
+
+            request.cancel()
+
+        except Exception as e:
+            logger.error("Gameloop error", exc_info=e)
+        finally:
+            self.running = False
+            self.gc.stop()
+            self.scribe.close()
+            self.flight.close()
+            if owned:
+                await aapi.aclose()
+            logger.info("Gameloop ended")
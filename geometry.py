@@ -0,0 +1,186 @@
+"""
+Round-level static geometry.
+
+Fences barely change within a round, so everything derived from them
+is built once and reused while the fence fingerprint stays the same.
+Planners only read the fence set, it is built with the geometry. The
+grids (occupancy, distance to the nearest fence) are built on first
+use. When fences do change, only the changed cells are patched.
+
+The cache is keyed by the fence fingerprint: sessions in the same round
+see the same fences and share one geometry. `Map.name` is the player
+name, it can not tell rounds apart.
+
+usage:
+geometry = static_geometry(world)
+if cell in geometry.fence_set:
+    ...
+"""
+
+import threading
+from collections import OrderedDict
+from logging import getLogger
+
+import numpy as np
+
+from gt import Map, Vec3d
+
+logger = getLogger(__name__)
+
+
+def fingerprint(fences) -> int:
+    if isinstance(fences, np.ndarray):
+        return hash((fences.shape, fences.tobytes()))
+    return hash(tuple(fences))
+
+
+class StaticGeometry:
+    def __init__(self, size: Vec3d, fences: list[Vec3d], fp: int = None):
+        self.size = size
+        self.fences = fences
+        self.fingerprint = fingerprint(fences) if fp is None else fp
+
+        self.fence_set = frozenset(fences)
+
+        self._occupancy: np.ndarray = None
+        self._distance = None
+
+    @property
+    def occupancy(self) -> np.ndarray:
+        """Boolean (x, y, z) grid of the fences. Built on first use."""
+        if self._occupancy is None:
+            occupancy = np.zeros(tuple(self.size), dtype=bool)
+            self._mark(occupancy, self.fence_set, True)
+            self._occupancy = occupancy
+        return self._occupancy
+
+    def _mark(self, occupancy: np.ndarray, cells, value: bool):
+        if not cells:
+            return
+        xyz = np.array(list(cells), dtype=np.int64).reshape(-1, 3)
+        inside = ((xyz >= 0) & (xyz < np.array(self.size))).all(axis=1)
+        xyz = xyz[inside]
+        occupancy[xyz[:, 0], xyz[:, 1], xyz[:, 2]] = value
+
+    def patch(self, fences: list[Vec3d], fp: int):
+        new = frozenset(fences)
+        added, removed = new - self.fence_set, self.fence_set - new
+
+        if self._occupancy is not None:
+            self._mark(self._occupancy, removed, False)
+            self._mark(self._occupancy, added, True)
+
+        self.fences = fences
+        self.fence_set = new
+        self.fingerprint = fp
+        self._distance = None
+
+        logger.info(f"🧱 Fences patched: +{len(added)} -{len(removed)}")
+
+    def blocked(self, cell: Vec3d) -> bool:
+        return cell in self.fence_set
+
+    def distance(self, limit=16) -> np.ndarray:
+        """
+        Manhattan distance from every cell to the nearest fence,
+        capped at `limit`. Built on first use.
+        """
+        if self._distance is not None and self._distance[1] >= limit:
+            return self._distance[0]
+
+        dist = np.full(self.occupancy.shape, limit, dtype=np.uint8)
+        front = self.occupancy.copy()
+        reached = front.copy()
+
+        for d in range(limit):
+            dist[front] = d
+
+            # One step of 6-neighbour dilation
+            grown = np.zeros_like(front)
+            grown[1:] |= front[:-1]
+            grown[:-1] |= front[1:]
+            grown[:, 1:] |= front[:, :-1]
+            grown[:, :-1] |= front[:, 1:]
+            grown[:, :, 1:] |= front[:, :, :-1]
+            grown[:, :, :-1] |= front[:, :, 1:]
+
+            front = grown & ~reached
+            if not front.any():
+                break
+            reached |= front
+
+        self._distance = (dist, limit)
+        return dist
+
+
+class GeometryCache:
+    """
+    `StaticGeometry` by fence fingerprint, sessions of a round share one.
+    A new fingerprint close to a cached one (fences changed mid-round)
+    patches that geometry, anything else builds a new one.
+    """
+
+    def __init__(self, rounds=4, patch_limit=0.1):
+        """
+        :param patch_limit: changed cells, as a share of the fences, still patched
+        """
+        self.rounds: OrderedDict[int, StaticGeometry] = OrderedDict()
+        self.size = rounds
+        self.patch_limit = patch_limit
+        self.lock = threading.Lock()
+
+        # Read without the lock, replaced as a whole under it
+        self.recent: tuple[StaticGeometry, ...] = ()
+
+    def get(self, world: Map) -> StaticGeometry:
+        # Fences of interned worlds are the cached list itself
+        for current in self.recent:
+            if world.fences is current.fences:
+                return current
+
+        fp = fingerprint(world.fences)
+
+        with self.lock:
+            current = self.rounds.get(fp)
+            if current is None or current.size != world.size:
+                current = self._patched(world, fp) or StaticGeometry(
+                    world.size, world.fences, fp
+                )
+                self.rounds[fp] = current
+
+            self.rounds.move_to_end(fp)
+            while len(self.rounds) > self.size:
+                self.rounds.popitem(last=False)
+            self.recent = tuple(reversed(self.rounds.values()))
+
+        return current
+
+    def _patched(self, world: Map, fp: int) -> StaticGeometry | None:
+        for old, geometry in reversed(self.rounds.items()):
+            if geometry.size != world.size:
+                continue
+
+            changed = geometry.fence_set.symmetric_difference(world.fences)
+            if len(changed) <= max(16, len(geometry.fence_set) * self.patch_limit):
+                del self.rounds[old]
+                geometry.patch(world.fences, fp)
+                return geometry
+
+        return None
+
+    def intern(self, world: Map) -> StaticGeometry:
+        """Share the cached fence list with `world`, one list per round"""
+        geometry = self.get(world)
+        if isinstance(world, Map):
+            world.fences = geometry.fences
+        else:
+            # `ColumnarMap.fences` is a cached view of its columns
+            world.__dict__["fences"] = geometry.fences
+        return geometry
+
+
+GEOMETRY = GeometryCache()
+
+
+def static_geometry(world: Map) -> StaticGeometry:
+    return GEOMETRY.get(world)
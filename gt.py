@@ -4,8 +4,25 @@ from typing import Any, Dict, List, Literal, NamedTuple, Optional
 
 from util.itypes import Vec2
 
-snakes = ["Abra", "Kadabra", "Bobra", "Vydra", "Tundra", "Mamba"][::-1]
-id_to_name = {}
+SNAKE_NAMES = ["Abra", "Kadabra", "Bobra", "Vydra", "Tundra", "Mamba"]
+
+
+class SnakeNames:
+    """
+    Short names of snake ids in order of appearance, one map per session.
+    Past the list the names repeat with a number: "Abra2", "Kadabra2", ...
+    """
+
+    def __init__(self):
+        self.names: dict[str, str] = {}
+
+    def __call__(self, snake: "Snake") -> str:
+        name = self.names.get(snake.id)
+        if name is None:
+            lap, i = divmod(len(self.names), len(SNAKE_NAMES))
+            name = SNAKE_NAMES[i] + (str(lap + 1) if lap else "")
+            self.names[snake.id] = name
+        return f"{name}#{snake.id[:5]}"
 
 
 class Vec3d(NamedTuple):
@@ -94,12 +111,6 @@ class Snake:
             return []
         return self.geometry[1:]
 
-    @property
-    def name(self):
-        if self.id not in id_to_name:
-            id_to_name[self.id] = snakes.pop()
-        return f"{id_to_name[self.id]}#{self.id[:5]}"
-
     def __bool__(self):
         return self.status == "alive" and bool(self.geometry)
 
@@ -0,0 +1,305 @@
+"""
+Bounded world history.
+
+Keeps a full `Map` (keyframe) every `keyframe_every` turns and only
+compact per-turn deltas in between: food added/removed/changed, fences
+when they change, plus the small parts (snakes, enemies, special food).
+
+Any turn is rebuilt on demand from the closest keyframe, recently rebuilt
+worlds are kept in a small LRU, so scrubbing the timeline stays cheap.
+
+Behaves like the list it replaces: `len(h)`, `h[i]`, `h[-1]`, `h.append(w)`.
+The gameloop appends while the viewer reads, both go through one lock.
+
+`LazyHistory` is the same list over a recorded replay with nothing
+decoded up front, turns become `decode.LazyMap`s when they are looked at.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import replaybin
+from columnar import ColumnarMap
+from decode import LazyMap
+from geometry import GEOMETRY
+from gt import EnemySnake, Food, Map, Snake, Vec3d
+from util import codec
+from util.scribe import Scribe
+from util.turnindex import TurnIndex
+from worldstate import WorldDiff, WorldModel
+
+
+@dataclass
+class Delta:
+    points: int
+    turn: int
+    tick_remain_ms: int
+    revive_timeout: int
+
+    # None when unchanged
+    fences: list[Vec3d] | None
+
+    food_added: list[Food]
+    food_removed: list[Vec3d]
+    food_changed: list[Food]
+
+    golden: list[Food]
+    sus: list[Food]
+    snakes: list[Snake]
+    enemies: list[EnemySnake]
+
+
+class History:
+    def __init__(self, *, keyframe_every=100, cache_size=16, max_turns=None):
+        """
+        :param keyframe_every: turns between full worlds
+        :param cache_size: rebuilt worlds kept in memory
+        :param max_turns: oldest turns are dropped above it, None - keep all
+        """
+        self.keyframe_every = keyframe_every
+        self.cache_size = cache_size
+        self.max_turns = max_turns
+
+        self.entries: list[Map | Delta] = []
+        self.cache: OrderedDict[int, Map] = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Absolute index of entries[0]
+        self.dropped = 0
+        self.model = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, world: Map, diff: WorldDiff = None):
+        """
+        :param diff: diff of `world` against the previous one, see `WorldModel`
+        """
+        with self.lock:
+            self._append(world, diff)
+
+    def _append(self, world: Map, diff: WorldDiff):
+        previous = self.entries[-1] if self.entries else None
+        # `ColumnarMap` has the same view, deltas are taken from it alike
+        worlds = (Map, ColumnarMap)
+
+        if diff is None and isinstance(world, worlds):
+            # Standalone use, nobody tracks the diffs for us
+            self.model = self.model or WorldModel()
+            diff = self.model.apply(world)
+
+        keyframe = (
+            not isinstance(previous, (*worlds, Delta))
+            or not isinstance(world, worlds)
+            or diff is None
+            or (self.dropped + len(self.entries)) % self.keyframe_every == 0
+        )
+
+        if keyframe:
+            self.entries.append(world)
+        else:
+            self.entries.append(
+                Delta(
+                    points=world.points,
+                    turn=world.turn,
+                    tick_remain_ms=world.tick_remain_ms,
+                    revive_timeout=world.revive_timeout,
+                    fences=world.fences if diff.fences_changed else None,
+                    food_added=diff.food_added,
+                    food_removed=diff.food_removed,
+                    food_changed=diff.food_changed,
+                    golden=world.golden,
+                    sus=world.sus,
+                    snakes=world.snakes,
+                    enemies=world.enemies,
+                )
+            )
+
+        self._remember(len(self.entries) - 1, world)
+        self._trim()
+
+    def _trim(self):
+        if not self.max_turns or len(self.entries) <= self.max_turns:
+            return
+
+        # Drop whole keyframe segments, the first entry must stay a keyframe
+        cut = len(self.entries) - self.max_turns
+        while cut < len(self.entries) and isinstance(self.entries[cut], Delta):
+            cut += 1
+
+        if cut >= len(self.entries):
+            return
+
+        del self.entries[:cut]
+        self.dropped += cut
+        self.cache = OrderedDict(
+            (i - cut, w) for i, w in self.cache.items() if i >= cut
+        )
+
+    def _remember(self, i: int, world: Map):
+        self.cache[i] = world
+        self.cache.move_to_end(i)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __getitem__(self, i: int) -> Map:
+        with self.lock:
+            if i < 0:
+                i += len(self.entries)
+            if not 0 <= i < len(self.entries):
+                raise IndexError("history index out of range")
+
+            if i in self.cache:
+                self.cache.move_to_end(i)
+                return self.cache[i]
+
+            entry = self.entries[i]
+            if not isinstance(entry, Delta):
+                return entry
+
+            world = self._rebuild(i)
+            self._remember(i, world)
+            return world
+
+    def _rebuild(self, i: int) -> Map:
+        # Nearest keyframe or cached world before `i`
+        start = i
+        while isinstance(self.entries[start], Delta) and start not in self.cache:
+            start -= 1
+
+        base = self.cache.get(start) or self.entries[start]
+        food = {f.coordinate: f for f in base.food}
+        fences = base.fences
+
+        delta = None
+        for delta in self.entries[start + 1 : i + 1]:
+            for c in delta.food_removed:
+                food.pop(c, None)
+            for f in delta.food_added:
+                food[f.coordinate] = f
+            for f in delta.food_changed:
+                food[f.coordinate] = f
+            if delta.fences is not None:
+                fences = delta.fences
+
+        return Map(
+            size=base.size,
+            points=delta.points,
+            name=base.name,
+            fences=fences,
+            food=list(food.values()),
+            golden=delta.golden,
+            sus=delta.sus,
+            enemies=delta.enemies,
+            snakes=delta.snakes,
+            turn=delta.turn,
+            tick_remain_ms=delta.tick_remain_ms,
+            revive_timeout=delta.revive_timeout,
+        )
+
+
+class LazyHistory:
+    def __init__(self, scribe: Scribe, *, cache_size=16):
+        """
+        Plain replays are sliced out of the memory-mapped file through the
+        turn index, compressed ones keep their raw lines in memory,
+        `replaybin` containers hand out their own lazy `ColumnarMap`s.
+
+        `start` and `upto` come from the scribe, as for `replay_iterator`.
+
+        :param cache_size: worlds kept decoded, the rest is dropped
+        """
+        self.cache_size = cache_size
+        self.cache: OrderedDict[int, Map] = OrderedDict()
+        self.lock = threading.Lock()
+
+        replay = scribe.replay
+        start = scribe.kwargs.get("start")
+        upto = scribe.kwargs.get("upto")
+
+        self.index: TurnIndex = None
+        self.container: replaybin.ColumnarReplay = None
+        self.lines: list[bytes] = None
+
+        if replaybin.is_container(replay):
+            self.container = replaybin.ColumnarReplay(replay)
+            first = self.container.position(start) if start else 0
+            count = len(self.container)
+        elif codec.detect(replay) is None:
+            self.index = TurnIndex.open(replay)
+            first = self.index.position(start) if start else 0
+            count = len(self.index)
+        else:
+            self.lines = list(scribe.replay_iterator(raw=True))
+            first, count = 0, len(self.lines)
+
+        last = min(count, first + upto) if upto else count
+        self.positions = range(first, last)
+
+        # Worlds appended after the replay
+        self.tail: list[Map] = []
+
+    def __len__(self):
+        return len(self.positions) + len(self.tail)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, world: Map, diff: WorldDiff = None):
+        self.tail.append(world)
+
+    def load(self, i: int) -> Map:
+        """World `i` built anew, the cache is not touched"""
+        if i >= len(self.positions):
+            return self.tail[i - len(self.positions)]
+
+        position = self.positions[i]
+        if self.container is not None:
+            world = self.container[position]
+        elif self.index is not None:
+            world = LazyMap(self.index.line(position))
+        else:
+            world = LazyMap(self.lines[position])
+
+        # One fence list per round, planners and the viewer find its
+        # geometry by identity instead of hashing the fences again
+        GEOMETRY.intern(world)
+        return world
+
+    def __getitem__(self, i: int) -> Map:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("history index out of range")
+
+        with self.lock:
+            if i in self.cache:
+                self.cache.move_to_end(i)
+                return self.cache[i]
+
+        # Decoded outside the lock, a concurrent miss of the same turn
+        # only costs a second decode
+        world = self.load(i)
+        if i >= len(self.positions):
+            return world
+
+        with self.lock:
+            self.cache[i] = world
+            self.cache.move_to_end(i)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return world
+
+    def close(self):
+        with self.lock:
+            self.cache.clear()
+        if self.index is not None:
+            self.index.close()
+        if self.container is not None:
+            self.container.close()
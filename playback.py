@@ -0,0 +1,176 @@
+"""
+Streaming replay playback.
+
+`PlaybackWindow` keeps decoded only the turns around the playhead: a
+background thread decodes ahead in the direction of playback and drops
+what fell behind, so a replay of any length plays within `behind + ahead`
+decoded worlds. The history underneath only hands out raw turns, see
+`history.LazyHistory`.
+
+`Playhead` moves the timepoint at a set speed, turns per second of wall
+time, negative plays backwards.
+
+usage:
+window = PlaybackWindow(history, behind=32, ahead=128)
+head = Playhead(speed=20)
+world = window[head.advance(timepoint, len(window))]
+"""
+
+import itertools
+import threading
+from logging import getLogger
+from time import perf_counter, sleep
+
+from decode import LAZY_FIELDS
+from gt import Map
+from history import LazyHistory
+from util.itypes import TIMERS
+
+logger = getLogger(__name__)
+
+
+def materialize(world: Map) -> Map:
+    """Decodes every lazy field now, not when the frame is drawn"""
+    for name in LAZY_FIELDS:
+        getattr(world, name)
+    return world
+
+
+class PlaybackWindow:
+    def __init__(self, history: LazyHistory, *, behind=32, ahead=128):
+        """
+        :param behind: turns kept behind the playhead
+        :param ahead: turns decoded ahead of it
+        """
+        self.history = history
+        self.behind = behind
+        self.ahead = ahead
+
+        self.worlds: dict[int, Map] = {}
+        self.position = 0
+        self.direction = 1
+
+        self.misses = 0
+        self.running = True
+        self.changed = threading.Condition()
+
+        self.thread = threading.Thread(
+            target=self._prefetch, name="playback", daemon=True
+        )
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.history)
+
+    def seek(self, i: int):
+        with self.changed:
+            if i != self.position:
+                self.direction = 1 if i > self.position else -1
+            self.position = i
+            self.changed.notify()
+
+    def __getitem__(self, i: int) -> Map:
+        if i < 0:
+            i += len(self)
+        self.seek(i)
+
+        world = self.worlds.get(i)
+        if world is None:
+            # Jumped out of the window, this frame waits for its turn
+            self.misses += 1
+            world = materialize(self.history.load(i))
+            with self.changed:
+                self.worlds[i] = world
+        return world
+
+    def _wanted(self) -> range:
+        first = self.position - (self.behind if self.direction > 0 else self.ahead)
+        last = self.position + (self.ahead if self.direction > 0 else self.behind)
+        return range(max(0, first), min(len(self), last + 1))
+
+    def _next(self) -> int | None:
+        """Closest turn in the playback direction that is not decoded yet"""
+        wanted = self._wanted()
+        if self.direction > 0:
+            order = itertools.chain(
+                range(self.position, wanted.stop),
+                range(self.position - 1, wanted.start - 1, -1),
+            )
+        else:
+            order = itertools.chain(
+                range(self.position, wanted.start - 1, -1),
+                range(self.position + 1, wanted.stop),
+            )
+
+        for i in order:
+            if i in wanted and i not in self.worlds:
+                return i
+        return None
+
+    def _evict(self):
+        wanted = self._wanted()
+        for i in [i for i in self.worlds if i not in wanted]:
+            del self.worlds[i]
+
+    def _prefetch(self):
+        while self.running:
+            with self.changed:
+                self._evict()
+                i = self._next()
+                if i is None:
+                    self.changed.wait(0.1)
+                    continue
+
+            start = perf_counter()
+            try:
+                world = materialize(self.history.load(i))
+            except Exception as e:
+                logger.error(f"Playback prefetch failed at {i}", exc_info=e)
+                sleep(1)
+                continue
+
+            with self.changed:
+                self.worlds[i] = world
+            TIMERS["playback prefetch"] = perf_counter() - start
+
+    def close(self):
+        self.running = False
+        with self.changed:
+            self.changed.notify()
+        self.thread.join()
+        self.worlds.clear()
+
+
+class Playhead:
+    def __init__(self, speed: float = 10.0):
+        """
+        :param speed: turns per second, negative plays backwards
+        """
+        self.speed = speed
+        self.playing = False
+
+        self.last: float = None
+        self.progress = 0.0
+
+    def pause(self):
+        self.playing = False
+        self.last = None
+
+    def advance(self, timepoint: int, length: int) -> int:
+        """Timepoint for this frame, stops at either end"""
+        if not self.playing:
+            self.last = None
+            return timepoint
+
+        now = perf_counter()
+        if self.last is not None:
+            self.progress += self.speed * (now - self.last)
+        self.last = now
+
+        step = int(self.progress)
+        self.progress -= step
+
+        timepoint = min(max(timepoint + step, 0), length - 1)
+        if timepoint in (0, length - 1) and step:
+            self.pause()
+        return timepoint
@@ -0,0 +1,263 @@
+"""
+Gameloop in its own process.
+
+The planner and the viewer do not share one GIL anymore: a heavy frame
+can not delay the turn, a heavy turn can not freeze the window.
+
+The child process runs a regular `Gameloop` and streams every world
+(the undecoded server payload) together with the current `SnakeBrain`
+paths over a local pipe, the viewer decodes them on its side.
+Commands from the UI (`add_command`, `ban_target`, ...) go the other way.
+
+usage:
+gameloop = RemoteGameloop(game_name="round").launch_async()
+"""
+
+import multiprocessing
+import threading
+from logging import getLogger
+from queue import Empty, Queue
+
+from client import ApiClient
+from columnar import decoder
+from gameloop import AsyncGameloop, Gameloop, UpdateState, WorldBuild
+from geometry import GEOMETRY
+from gt import Map, Snake, SnakeBrain, Vec3d
+from history import History
+from util.budget import Scheduler
+from util.clock import TickClock
+from util.itypes import COUNTERS, TIMERS
+from worldstate import WorldModel
+
+logger = getLogger(__name__)
+
+
+def _context():
+    # Forked before the window is created: imgui and pygame are already
+    # imported by `super`, the child inherits the modules but no display
+    # or GL context, and never calls into them
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
+
+
+def pack_brains(paths: list[SnakeBrain]):
+    return [(b.snake.id, b.path, b.direction, b.thinks) for b in paths]
+
+
+def unpack_brains(world: Map, brains) -> list[SnakeBrain]:
+    if not world:
+        return []
+
+    snakes = {s.id: s for s in world.snakes}
+    return [
+        SnakeBrain(snakes[id], path, direction, thinks)
+        for id, path, direction, thinks in brains
+        if id in snakes
+    ]
+
+
+def serve(conn, aio: bool, hedge: bool, kwargs: dict):
+    """Child process: run the gameloop, publish worlds, apply commands"""
+    client = ApiClient("prod", hedge=hedge)
+    gl = (AsyncGameloop if aio else Gameloop)(client=client, **kwargs)
+
+    outbox = Queue()
+    gl.world_builder.listeners.append(lambda raw, world: outbox.put(raw))
+
+    def publish():
+        # Sending is done here, a slow viewer never blocks the gameloop
+        paths = gl.paths
+        while True:
+            try:
+                raw = outbox.get(timeout=0.05)
+            except Empty:
+                raw = ...
+
+            if raw is None:
+                return
+
+            if raw is ...:
+                if gl.paths is not paths:
+                    paths = gl.paths
+                    conn.send(("paths", pack_brains(paths)))
+                continue
+
+            paths = gl.paths
+            stats = dict(TIMERS), dict(COUNTERS)
+            state = (gl.upd, stats, gl.scheduler, gl.clock)
+            conn.send(("world", raw, pack_brains(paths), *state))
+
+    publisher = threading.Thread(target=publish, daemon=True)
+    publisher.start()
+
+    gl.launch_async()
+
+    try:
+        while gl.running:
+            if not conn.poll(0.05):
+                continue
+
+            match conn.recv():
+                case ("command", command):
+                    gl.add_command(command)
+                case ("ban", target):
+                    gl.ban_target(target)
+                case ("banned", banned):
+                    gl.banned = banned
+                case ("autopilot", value):
+                    gl.autopilot = value
+                case ("simulate", timepoint):
+                    gl.replay_simulate = timepoint
+                case ("stop",):
+                    gl.running = False
+
+    except (EOFError, OSError):
+        gl.running = False
+
+    finally:
+        gl.executor_thread.join()
+        outbox.put(None)
+        publisher.join()
+        conn.close()
+
+
+class RemoteWorldBuild(WorldBuild):
+    """Viewer side history, filled from the gameloop process"""
+
+    def __init__(self, init: Map, columnar: bool, history: dict = None):
+        self.history = History(**(history or {}))
+        self.decode = decoder(columnar)
+
+        self.model = WorldModel()
+        self.history.append(init, self.model.apply(init) if init else None)
+
+    def push_raw(self, raw) -> Map:
+        world = self.decode(raw)
+        GEOMETRY.intern(world)
+        world = self.merge_world(self.history[-1], world)
+        self.history.append(world, self.diff)
+        return world
+
+
+class RemoteGameloop:
+    """
+    Stand-in for `Gameloop` on the viewer side.
+
+    Exposes what `Super` reads and forwards what it changes.
+    """
+
+    def __init__(self, *, aio=False, hedge=False, **kwargs):
+        ctx = _context()
+
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=serve,
+            args=(child, aio, hedge, kwargs),
+            name="gameloop",
+            daemon=True,
+        )
+        self.receiver = None
+
+        self.replay = bool(kwargs.get("replay_file"))
+        self.world_builder = RemoteWorldBuild(
+            kwargs.get("init"), kwargs.get("columnar", False), kwargs.get("history")
+        )
+
+        self.upd = UpdateState(0, 0, "Network", 0, 0)
+        self.paths: list[SnakeBrain] = []
+        self.scheduler = Scheduler()
+        self.clock = TickClock()
+
+        self._running = True
+        self._banned = set()
+        self._autopilot = False
+        self._simulate = None
+
+    def send(self, *message):
+        try:
+            self.conn.send(message)
+        except OSError:
+            self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    @running.setter
+    def running(self, value):
+        if not value and self._running:
+            self.send("stop")
+        self._running = value
+
+    @property
+    def banned(self):
+        return self._banned
+
+    @banned.setter
+    def banned(self, value):
+        self._banned = value
+        self.send("banned", value)
+
+    @property
+    def autopilot(self):
+        return self._autopilot
+
+    @autopilot.setter
+    def autopilot(self, value):
+        if value != self._autopilot:
+            self.send("autopilot", value)
+        self._autopilot = value
+
+    @property
+    def replay_simulate(self):
+        return self._simulate
+
+    @replay_simulate.setter
+    def replay_simulate(self, value):
+        if value != self._simulate:
+            self.send("simulate", value)
+        self._simulate = value
+
+    def add_command(self, command):
+        self.send("command", command)
+
+    def ban_target(self, target: Vec3d):
+        self._banned.add(target)
+        self.send("ban", target)
+
+    def get_brain(self, snake: Snake):
+        for p in self.paths:
+            if p.snake.id == snake.id:
+                return p
+
+        return None
+
+    def receive(self):
+        try:
+            while True:
+                match self.conn.recv():
+                    case ("world", raw, brains, upd, stats, scheduler, clock):
+                        world = self.world_builder.push_raw(raw)
+                        self.paths = unpack_brains(world, brains)
+                        self.upd, self.scheduler, self.clock = upd, scheduler, clock
+                        TIMERS.update(stats[0])
+                        COUNTERS.update(stats[1])
+
+                    case ("paths", brains):
+                        world, _ = self.world_builder.get_latest_world()
+                        self.paths = unpack_brains(world, brains)
+
+        except (EOFError, OSError):
+            pass
+
+        finally:
+            self._running = False
+            logger.info("Gameloop process ended")
+
+    def launch_async(self):
+        self.process.start()
+
+        self.receiver = threading.Thread(target=self.receive, daemon=True)
+        self.receiver.start()
+        return self
@@ -0,0 +1,471 @@
+"""
+Binary columnar replay container, `.rcol`.
+
+Static round data (size, name, fences) is stored once, and again only
+when it changes. Turns are grouped into chunks, a chunk is a handful of
+flat numpy columns (food, snakes, enemies of all its turns) saved as
+npz and compressed as a whole. A footer lists every block with its turn
+range, so any turn range is read by decompressing only its chunks.
+
+Reading never touches JSON, worlds come out as `ColumnarMap`.
+
+layout:
+MAGIC
+block*   - kind, codec, length, first turn, turns + payload
+           S: static data, C: chunk of turns, I: index of S and C blocks
+trailer  - offset of the I block + END
+
+A file whose recording did not finish has no trailer, its blocks are
+found by walking the headers, up to the last complete chunk.
+
+usage:
+with ColumnarWriter("data/round.rcol") as writer:
+    writer.append(world)
+
+replay = ColumnarReplay("data/round.rcol")
+for world in replay.range(1000, 1100):
+    ...
+
+python replaybin.py convert data/round.ljson
+"""
+
+import io
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from fire import Fire
+
+from columnar import COORD, ColumnarMap, decode_columnar, decoder
+from gt import Vec3d
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"DNWRCOL1"
+END = b"DNWREND1"
+
+BLOCK = struct.Struct("<ccQiI")
+TRAILER = struct.Struct("<Q8s")
+
+STATIC, CHUNK, INDEX = b"S", b"C", b"I"
+
+
+def is_container(path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _pack(arrays: dict, level: int) -> tuple[bytes, bytes]:
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    data = buffer.getvalue()
+
+    if zstandard:
+        return b"s", zstandard.ZstdCompressor(level=level).compress(data)
+    return b"z", zlib.compress(data, min(level, 9))
+
+
+def _unpack(codec: bytes, data: bytes) -> dict:
+    if codec == b"s":
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == b"z":
+        data = zlib.decompress(data)
+
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+def _strings(values: list) -> np.ndarray:
+    return np.array(values, dtype=str) if values else np.empty(0, dtype="U1")
+
+
+def _lengths(offsets: np.ndarray) -> np.ndarray:
+    return np.diff(offsets).astype(np.int32)
+
+
+def _starts(lengths: np.ndarray) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+class ColumnarWriter:
+    """
+    Appends worlds to a container.
+
+    Turns are buffered into chunks of `chunk_turns`, a crash loses at
+    most the chunk being filled.
+    """
+
+    def __init__(self, path, *, chunk_turns=64, level=3):
+        self.path = Path(path)
+        self.chunk_turns = chunk_turns
+        self.level = level
+
+        self.blocks = []
+        self.pending: list[tuple[int, ColumnarMap]] = []
+        self.static = None
+        self.statics = 0
+
+        if self.path.is_file() and self.path.stat().st_size:
+            # Continue the recording, the footer is written again on close
+            replay = ColumnarReplay(self.path)
+            self.blocks = replay.blocks
+            self.statics = len(replay.statics)
+            if replay.statics:
+                # Same round after a restart, its static block is not repeated
+                last = replay.statics[-1]
+                self.static = self._key(last["name"], last["size"], last["fence_xyz"])
+            replay.close()
+
+            self.file = self.path.open("r+b")
+            self.file.truncate(replay.end)
+            self.file.seek(replay.end)
+        else:
+            self.file = self.path.open("wb")
+            self.file.write(MAGIC)
+
+    def _block(self, kind: bytes, arrays: dict, first: int, count: int):
+        codec, payload = _pack(arrays, self.level)
+        offset = self.file.tell()
+        self.file.write(BLOCK.pack(kind, codec, len(payload), first, count))
+        self.file.write(payload)
+        self.blocks.append((kind, offset, first, count))
+
+    @staticmethod
+    def _key(name: str, size, fence_xyz: np.ndarray) -> tuple:
+        return name, tuple(size), fence_xyz.astype(COORD).tobytes()
+
+    def _static(self, world: ColumnarMap) -> int:
+        key = self._key(world.name, world.size, world.fence_xyz)
+        if key != self.static:
+            self.static = key
+            self.statics += 1
+            arrays = dict(
+                size=np.array(world.size, dtype=np.int32),
+                name=np.array(world.name),
+                fence_xyz=world.fence_xyz,
+            )
+            self._block(STATIC, arrays, world.turn, 1)
+        return self.statics - 1
+
+    def append(self, world: ColumnarMap):
+        self.pending.append((self._static(world), world))
+        if len(self.pending) >= self.chunk_turns:
+            self.flush_chunk()
+
+    def write_batch(self, items: list[bytes | ColumnarMap]):
+        """
+        Sink interface of `util.scribe.BackgroundWriter`, json lines or
+        worlds the gameloop decoded already
+        """
+        for item in items:
+            if not isinstance(item, ColumnarMap):
+                item = decode_columnar(item)
+            self.append(item)
+
+    def flush_chunk(self):
+        if not self.pending:
+            return
+
+        statics, worlds = zip(*self.pending)
+        self.pending = []
+
+        def cat(name, dtype=None):
+            parts = [getattr(w, name) for w in worlds]
+            return np.concatenate(parts).astype(dtype or parts[0].dtype, copy=False)
+
+        def rows(name):
+            return _starts(np.array([len(getattr(w, name)) for w in worlds]))
+
+        arrays = dict(
+            static=np.array(statics, dtype=np.int32),
+            turn=np.array([w.turn for w in worlds], dtype=np.int32),
+            points=np.array([w.points for w in worlds], dtype=np.int64),
+            tick_remain_ms=np.array([w.tick_remain_ms for w in worlds], np.int32),
+            revive_timeout=np.array([w.revive_timeout for w in worlds], np.int32),
+            # food
+            food_rows=rows("food_points"),
+            food_xyz=cat("food_xyz"),
+            food_points=cat("food_points"),
+            food_type=cat("food_type"),
+            food_listed=cat("food_listed"),
+            # snakes, one row per snake, geometry by lengths
+            snake_rows=rows("snake_ids"),
+            snake_ids=_strings([i for w in worlds for i in w.snake_ids]),
+            snake_direction=cat("snake_direction"),
+            snake_old_direction=cat("snake_old_direction"),
+            snake_deaths=cat("snake_deaths", np.int32),
+            snake_status=_strings([s for w in worlds for s in w.snake_status]),
+            snake_revive=np.array(
+                [-1 if r is None else r for w in worlds for r in w.snake_revive],
+                dtype=np.int64,
+            ),
+            snake_length=np.concatenate([_lengths(w.snake_offsets) for w in worlds]),
+            snake_xyz=cat("snake_xyz"),
+            # enemies
+            enemy_rows=rows("enemy_status"),
+            enemy_status=_strings([s for w in worlds for s in w.enemy_status]),
+            enemy_kills=cat("enemy_kills", np.int32),
+            enemy_length=np.concatenate([_lengths(w.enemy_offsets) for w in worlds]),
+            enemy_xyz=cat("enemy_xyz"),
+        )
+        self._block(CHUNK, arrays, worlds[0].turn, len(worlds))
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def flush(self):
+        # A partial chunk is not written, small chunks compress badly
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.flush_chunk()
+
+        kinds, offsets, firsts, counts = zip(*self.blocks) if self.blocks else [()] * 4
+        index = dict(
+            kind=np.frombuffer(b"".join(kinds), dtype=np.uint8),
+            offset=np.array(offsets, dtype=np.int64),
+            first=np.array(firsts, dtype=np.int32),
+            count=np.array(counts, dtype=np.int32),
+        )
+
+        at = self.file.tell()
+        self._block(INDEX, index, 0, len(self.blocks))
+        self.file.write(TRAILER.pack(at, END))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ColumnarReplay:
+    def __init__(self, path, *, cache_chunks=4):
+        self.path = Path(path)
+        self.file = self.path.open("rb")
+        # The playback thread, the viewer and the simulator all read, one
+        # seek + read at a time, the chunk cache has its own lock
+        self.reading = threading.Lock()
+        self.lock = threading.Lock()
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a columnar replay: {self.path}")
+
+        # Static and chunk blocks, where they end
+        self.blocks, self.end = self._index()
+        blocks = self.blocks
+
+        self.statics = [
+            self._static(offset) for kind, offset, _, _ in blocks if kind == STATIC
+        ]
+
+        chunks = [
+            (offset, first, count)
+            for kind, offset, first, count in blocks
+            if kind == CHUNK
+        ]
+        self.chunk_offset = np.array([c[0] for c in chunks], dtype=np.int64)
+        self.chunk_first = np.array([c[1] for c in chunks], dtype=np.int32)
+        # Global position of the first turn of every chunk
+        self.chunk_start = _starts(np.array([c[2] for c in chunks], dtype=np.int64))
+
+        self.cache: OrderedDict[int, dict] = OrderedDict()
+        self.cache_chunks = cache_chunks
+
+    def _read_block(self, offset: int) -> tuple[bytes, bytes, int, int, bytes]:
+        with self.reading:
+            self.file.seek(offset)
+            head = self.file.read(BLOCK.size)
+            kind, codec, length, first, count = BLOCK.unpack(head)
+            return kind, codec, first, count, self.file.read(length)
+
+    def _index(self) -> tuple[list[tuple], int]:
+        size = self.path.stat().st_size
+
+        if size >= len(MAGIC) + TRAILER.size:
+            self.file.seek(size - TRAILER.size)
+            at, end = TRAILER.unpack(self.file.read(TRAILER.size))
+            if end == END:
+                _, codec, _, _, payload = self._read_block(at)
+                index = _unpack(codec, payload)
+                blocks = zip(
+                    [bytes([k]) for k in index["kind"].tolist()],
+                    index["offset"].tolist(),
+                    index["first"].tolist(),
+                    index["count"].tolist(),
+                )
+                return list(blocks), at
+
+        # Unfinished recording, walk the block headers
+        blocks = []
+        offset = len(MAGIC)
+        while offset + BLOCK.size <= size:
+            self.file.seek(offset)
+            kind, _, length, first, count = BLOCK.unpack(self.file.read(BLOCK.size))
+            if offset + BLOCK.size + length > size or kind not in (STATIC, CHUNK):
+                break
+            blocks.append((kind, offset, first, count))
+            offset += BLOCK.size + length
+
+        return blocks, offset
+
+    def _static(self, offset: int) -> dict:
+        _, codec, _, _, payload = self._read_block(offset)
+        static = _unpack(codec, payload)
+        fence_xyz = static["fence_xyz"]
+        return dict(
+            size=tuple(static["size"].tolist()),
+            name=str(static["name"]),
+            fence_xyz=fence_xyz,
+            # One list per static block, shared by all its worlds
+            fences=[Vec3d(*p) for p in fence_xyz.tolist()],
+        )
+
+    def chunk(self, i: int) -> dict:
+        with self.lock:
+            if i in self.cache:
+                self.cache.move_to_end(i)
+                return self.cache[i]
+
+        # Decompressed outside the lock, a concurrent miss of the same
+        # chunk only costs a second decompression
+        _, codec, _, _, payload = self._read_block(int(self.chunk_offset[i]))
+        chunk = _unpack(codec, payload)
+        chunk["snake_start"] = _starts(chunk["snake_length"])
+        chunk["enemy_start"] = _starts(chunk["enemy_length"])
+
+        with self.lock:
+            self.cache[i] = chunk
+            self.cache.move_to_end(i)
+            while len(self.cache) > self.cache_chunks:
+                self.cache.popitem(last=False)
+        return chunk
+
+    def __len__(self) -> int:
+        return int(self.chunk_start[-1])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, position: int) -> ColumnarMap:
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("replay position out of range")
+
+        i = int(np.searchsorted(self.chunk_start, position, side="right")) - 1
+        return self._world(self.chunk(i), position - int(self.chunk_start[i]))
+
+    def position(self, turn: int) -> int:
+        """Position of the first world at `turn` or later"""
+        i = max(0, int(np.searchsorted(self.chunk_first, turn, side="right")) - 1)
+        while i < len(self.chunk_first):
+            turns = self.chunk(i)["turn"]
+            j = int(np.searchsorted(turns, turn))
+            if j < len(turns):
+                return int(self.chunk_start[i]) + j
+            i += 1
+        return len(self)
+
+    def range(self, start: int = None, stop: int = None):
+        """Worlds for turns `start` up to `stop` (excluded)"""
+        first = 0 if start is None else self.position(start)
+        last = len(self) if stop is None else self.position(stop)
+        for position in range(first, last):
+            yield self[position]
+
+    def _world(self, c: dict, t: int) -> ColumnarMap:
+        static = self.statics[int(c["static"][t])]
+
+        f0, f1 = c["food_rows"][t], c["food_rows"][t + 1]
+        s0, s1 = c["snake_rows"][t], c["snake_rows"][t + 1]
+        e0, e1 = c["enemy_rows"][t], c["enemy_rows"][t + 1]
+
+        snake_start = c["snake_start"][s0 : s1 + 1]
+        enemy_start = c["enemy_start"][e0 : e1 + 1]
+
+        world = ColumnarMap(
+            size=static["size"],
+            points=int(c["points"][t]),
+            name=static["name"],
+            turn=int(c["turn"][t]),
+            tick_remain_ms=int(c["tick_remain_ms"][t]),
+            revive_timeout=int(c["revive_timeout"][t]),
+            fence_xyz=static["fence_xyz"],
+            food_xyz=c["food_xyz"][f0:f1],
+            food_points=c["food_points"][f0:f1],
+            food_type=c["food_type"][f0:f1],
+            food_listed=c["food_listed"][f0:f1],
+            snake_ids=c["snake_ids"][s0:s1].tolist(),
+            snake_direction=c["snake_direction"][s0:s1],
+            snake_old_direction=c["snake_old_direction"][s0:s1],
+            snake_deaths=c["snake_deaths"][s0:s1],
+            snake_status=c["snake_status"][s0:s1].tolist(),
+            snake_revive=[
+                None if r < 0 else r for r in c["snake_revive"][s0:s1].tolist()
+            ],
+            snake_offsets=(snake_start - snake_start[0]).astype(np.int32),
+            snake_xyz=c["snake_xyz"][snake_start[0] : snake_start[-1]],
+            enemy_status=c["enemy_status"][e0:e1].tolist(),
+            enemy_kills=c["enemy_kills"][e0:e1],
+            enemy_offsets=(enemy_start - enemy_start[0]).astype(np.int32),
+            enemy_xyz=c["enemy_xyz"][enemy_start[0] : enemy_start[-1]],
+        )
+        world.__dict__["fences"] = static["fences"]
+        return world
+
+    def close(self):
+        self.file.close()
+
+
+def convert(src, dst=None, chunk_turns=64, level=3):
+    """
+    `.ljson` (plain or compressed) -> `.rcol`
+
+    usage:
+    python replaybin.py convert data/round.ljson
+    """
+    from util.scribe import Scribe
+
+    source = Scribe(src, enabled=False)
+    dst = Path(dst) if dst else Path(str(src).split(".ljson")[0] + ".rcol")
+
+    if dst.resolve() == source.replay.resolve():
+        raise ValueError(f"Refusing to overwrite the source: {dst}")
+
+    decode = decoder(True)
+    turns = 0
+    with ColumnarWriter(dst, chunk_turns=chunk_turns, level=level) as writer:
+        for payload in source.payloads():
+            writer.append(decode(payload))
+            turns += 1
+
+    before, after = source.replay.stat().st_size, dst.stat().st_size
+    print(
+        f"📦 {turns} turns, {before / 2**20:.1f}MB -> {after / 2**20:.1f}MB"
+        f" (x{before / max(after, 1):.1f}): {dst}"
+    )
+
+
+def info(src):
+    replay = ColumnarReplay(src)
+    print(f"📦 {len(replay)} turns, {len(replay.chunk_first)} chunks")
+    for static in replay.statics:
+        print(f"📦 {static['name']} {static['size']}, {len(static['fences'])} fences")
+    replay.close()
+
+
+if __name__ == "__main__":
+    Fire({"convert": convert, "info": info})
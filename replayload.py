@@ -0,0 +1,204 @@
+"""
+Bulk replay loader.
+
+Decoding json is the slow part of opening a replay, so it goes to a
+process pool: plain replays are cut into byte ranges with the turn index
+(`util.turnindex`), compressed ones into batches of lines read here.
+Workers send back the worlds the history keeps, `ColumnarMap`s or
+`Map`s, so nothing is converted here. Fences are sent once per batch.
+Batches come back in order and go into the history one by one, so the
+first turns can be shown right away.
+
+`replaybin` containers need no json, they are read here directly.
+
+usage:
+loader = ReplayLoader(scribe, columnar=False)
+for world in loader.worlds():
+    ...
+print(loader.loaded, loader.total)
+"""
+
+import itertools
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from time import perf_counter
+
+import numpy as np
+
+import replaybin
+from columnar import ColumnarMap, decoder
+from gt import Map
+from util import codec
+from util.gcmode import paused
+from util.scribe import Scribe
+from util.turnindex import TurnIndex
+
+logger = getLogger(__name__)
+
+
+def _context():
+    # Spawn and forkserver workers import `__main__` again, for the viewer
+    # that is `super` with pygame and imgui. Forked ones inherit the loaded
+    # modules and only ever run `decode_batch`
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
+
+
+def _same_fences(a, b) -> bool:
+    if isinstance(a, np.ndarray):
+        return np.array_equal(a, b)
+    return a == b
+
+
+def decode_batch(task, columnar=True) -> list[ColumnarMap | Map]:
+    """
+    Worker side: `(path, offset, length)` or a list of raw lines.
+
+    Fences equal to the previous world of the batch are left out (None),
+    `fence_xyz` of a `ColumnarMap`, `fences` of a `Map`.
+    """
+    if isinstance(task, tuple):
+        path, offset, length = task
+        with open(path, "rb") as f:
+            f.seek(offset)
+            task = f.read(length).split(b"\n")
+
+    decode = decoder(columnar)
+    with paused():
+        worlds = [decode(line) for line in task if line.strip()]
+
+    name = "fence_xyz" if columnar else "fences"
+    previous = None
+    for world in worlds:
+        fences = getattr(world, name)
+        if previous is not None and _same_fences(fences, previous):
+            setattr(world, name, None)
+        else:
+            previous = fences
+
+    return worlds
+
+
+class ReplayLoader:
+    def __init__(self, scribe: Scribe, columnar: bool, *, workers=None, batch=32):
+        """
+        :param workers: decoding processes, 0 - decode here
+        :param batch: turns per task
+        """
+        self.scribe = scribe
+        self.columnar = columnar
+        self.batch = batch
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        # Daemon processes (see `procloop`) can not have children
+        if multiprocessing.current_process().daemon:
+            workers = 0
+        self.workers = workers
+
+        self.loaded = 0
+        self.total: int = None
+
+    def _ranges(self):
+        """Byte ranges of `batch` turns, plain replays only"""
+        start = self.scribe.kwargs.get("start")
+        upto = self.scribe.kwargs.get("upto")
+
+        # Reading a replay leaves no sidecar behind, the recorder writes it
+        index = TurnIndex.open(self.scribe.replay, save=False)
+        rows = index.rows
+        index.close()
+
+        first = index.position(start) if start else 0
+        last = min(len(rows), first + upto) if upto else len(rows)
+        self.total = last - first
+
+        path = str(self.scribe.replay)
+        for i in range(first, last, self.batch):
+            j = min(i + self.batch, last) - 1
+            offset = int(rows[i]["offset"])
+            end = int(rows[j]["offset"] + rows[j]["length"])
+            yield path, offset, end - offset
+
+    def _chunks(self, items):
+        items = iter(items)
+        while batch := list(itertools.islice(items, self.batch)):
+            yield batch
+
+    def _batches(self):
+        replay = self.scribe.replay
+
+        if replaybin.is_container(replay):
+            # Already columns, nothing to decode
+            container = replaybin.ColumnarReplay(replay)
+            self.total = len(container)
+            container.close()
+            yield from self._chunks(self.scribe.payloads())
+            return
+
+        if codec.detect(replay) is None:
+            tasks = self._ranges()
+        else:
+            tasks = self._chunks(self.scribe.payloads())
+
+        if self.workers <= 1:
+            for task in tasks:
+                yield decode_batch(task, self.columnar)
+            return
+
+        with ProcessPoolExecutor(self.workers, mp_context=_context()) as pool:
+            # In order, a few batches per worker in flight, memory stays flat
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.submit(decode_batch, task, self.columnar))
+                if len(pending) >= 4 * self.workers:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+
+    def worlds(self):
+        start = perf_counter()
+        fence_xyz, fences = None, None
+
+        for batch in self._batches():
+            for world in batch:
+                if isinstance(world, Map):
+                    # Decoded by the workers already
+                    if world.fences is None:
+                        world.fences = fences
+                    elif world.fences is not fences and world.fences == fences:
+                        # Same fences from another batch, keep one list
+                        world.fences = fences
+                    else:
+                        fences = world.fences
+
+                    self.loaded += 1
+                    yield world
+                    continue
+
+                if world.fence_xyz is None:
+                    world.fence_xyz = fence_xyz
+                    world.__dict__["fences"] = fences
+                elif world.fence_xyz is not fence_xyz:
+                    if fence_xyz is not None and np.array_equal(
+                        world.fence_xyz, fence_xyz
+                    ):
+                        # Same fences from another batch, keep one list
+                        world.fence_xyz = fence_xyz
+                        world.__dict__["fences"] = fences
+                    else:
+                        fence_xyz, fences = world.fence_xyz, world.fences
+
+                self.loaded += 1
+                # Only `replaybin` containers come as columns in `Map` mode
+                yield world if self.columnar else world.to_map()
+
+        logger.info(
+            f"📼 {self.loaded} turns loaded in {perf_counter() - start:.1f}s"
+            f" by {max(self.workers, 1)} workers"
+        )
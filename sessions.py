@@ -0,0 +1,112 @@
+"""
+Several game sessions in one process.
+
+A session is one account (token) playing its active round, with its own
+world builder and recorder. Sessions share one connection pool and one
+set of planning workers, the worker goes to the session whose turn ends
+first (see `util.budget.DeadlinePool`).
+
+`TIMERS` stay process wide, they show whichever session wrote last.
+
+usage:
+python sessions.py --tokens DAD_TOKEN,DAD_TOKEN_2 --workers 4
+"""
+
+import threading
+from logging import getLogger
+from os import environ
+
+from fire import Fire
+
+from bot import report_startup, status_listener
+from client import ApiClient, AsyncApiClient
+from gameloop import AsyncGameloop, Gameloop
+from util.budget import DeadlinePool
+from util.rounds import wait_round
+
+logger = getLogger(__name__)
+
+
+def main(
+    *,
+    tokens=("DAD_TOKEN",),
+    workers: int = 2,
+    aio: bool = False,
+    hedge: bool = False,
+    columnar: bool = False,
+    max_turns: int = None,
+    keyframe_every: int = 100,
+    lead: float = 3.0,
+    status_every: int = 50,
+    compression: str = None,
+):
+    """
+    :param tokens: names of the environment variables holding the tokens
+    :param workers: planning threads shared by all sessions
+    """
+    if isinstance(tokens, str):
+        tokens = tokens.split(",")
+
+    report_startup("Imports")
+
+    # Two connections per session, the request and a hedge
+    shared = ApiClient("prod", pool=2 * len(tokens), hedge=hedge)
+
+    # The async pool belongs to the event loop, it is warmed there
+    active = wait_round(shared, lead, ready=None if aio else shared.warmup)
+    name = active["name"]
+    print(f"🚀 Playing round: {name} with {len(tokens)} sessions")
+
+    planner = DeadlinePool(workers)
+
+    gameloop_class = AsyncGameloop if aio else Gameloop
+    gameloops = []
+
+    if aio:
+        # Async sessions run on one event loop, over one async pool
+        shared = AsyncApiClient("prod", pool=2 * len(tokens), hedge=hedge)
+
+    for var in tokens:
+        gameloop = gameloop_class(
+            game_name=f"{name}-{var.lower()}",
+            columnar=columnar,
+            history=dict(max_turns=max_turns, keyframe_every=keyframe_every),
+            client=shared.session(environ[var]),
+            planner=planner,
+            compression=compression,
+        )
+        gameloop.autopilot = True
+        gameloop.world_builder.listeners.append(status_listener(status_every))
+        gameloops.append(gameloop)
+
+    if aio:
+        threads = [
+            threading.Thread(
+                target=AsyncGameloop.loop_together, args=(gameloops, shared)
+            )
+        ]
+        threads[0].start()
+    else:
+        threads = [g.launch_async().executor_thread for g in gameloops]
+
+    report_startup("Ready")
+
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        for gameloop in gameloops:
+            gameloop.running = False
+        for thread in threads:
+            thread.join()
+    finally:
+        planner.shutdown()
+
+    for var, gameloop in zip(tokens, gameloops):
+        logger.info(f"🏁 {var}: overruns {gameloop.scheduler.total_overruns}")
+
+    logger.info(f"🏁 Plans started after their deadline: {planner.late}")
+
+
+if __name__ == "__main__":
+    Fire(main)
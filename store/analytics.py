@@ -0,0 +1,230 @@
+"""
+Season analytics over a directory of replays.
+
+Every replay is decoded by a worker process, one pass, turn by turn,
+into a few per-game metrics:
+
+- points over time (quartiles of the game and the final score)
+- deaths per snake
+- food eaten by type (a food item under our head on the next turn)
+- `tickRemainMs` when our request arrived, as a histogram
+
+Workers send back small dicts, histograms merge exactly, the result is
+one table with a row per game and a total.
+
+usage:
+python -m store.analytics data/
+python -m store.analytics data/ --snakes --out data/summary.csv
+"""
+
+import csv
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from fire import Fire
+
+from columnar import FOOD_NAMES, FOOD_TYPES, GOLDEN, SUSPICIOUS, ColumnarMap
+from store.export import scribe_worlds
+
+# tickRemainMs histogram, 10ms bins, a tick is well under a second
+TICK_EDGES = np.arange(0, 1010, 10)
+
+REPLAYS = ("*.ljson", "*.ljson.gz", "*.ljson.zst", "*.rcol")
+
+
+def _keys(xyz: np.ndarray) -> np.ndarray:
+    xyz = xyz.astype(np.int64)
+    return (xyz[:, 0] << 32) | (xyz[:, 1] << 16) | xyz[:, 2]
+
+
+def _heads(world: ColumnarMap) -> np.ndarray:
+    offsets = world.snake_offsets
+    alive = np.diff(offsets) > 0
+    return world.snake_xyz[offsets[:-1][alive]]
+
+
+def by_type(codes: np.ndarray) -> np.ndarray:
+    """Counts per `FOOD_TYPES`, a golden and suspicious item counts for both"""
+    n = np.bincount(codes, minlength=len(FOOD_NAMES))
+    both = GOLDEN | SUSPICIOUS
+    return np.array([n[0], n[GOLDEN] + n[both], n[SUSPICIOUS] + n[both]])
+
+
+def percentile(hist: np.ndarray, q: float) -> float:
+    """Lower edge of the bin holding the `q` quantile"""
+    total = hist.sum()
+    if not total:
+        return float("nan")
+    return float(TICK_EDGES[np.searchsorted(np.cumsum(hist), q * total)])
+
+
+def game_metrics(path) -> dict:
+    path = Path(path)
+    start = perf_counter()
+
+    points = []
+    deaths: dict[str, int] = {}
+    eaten = np.zeros(len(FOOD_TYPES), dtype=np.int64)
+    ticks = []
+
+    previous = None
+    for world in scribe_worlds(path):
+        points.append(world.points)
+        ticks.append(world.tick_remain_ms)
+
+        for id, count in zip(world.snake_ids, world.snake_deaths.tolist()):
+            deaths[id] = count
+
+        if previous is not None and len(previous.food_xyz):
+            heads = _heads(world)
+            if len(heads):
+                # Gone under our head, golden and suspicious included
+                under = np.isin(_keys(previous.food_xyz), _keys(heads))
+                eaten += by_type(previous.food_type[under])
+        previous = world
+
+    hist, _ = np.histogram(np.clip(ticks, 0, TICK_EDGES[-1] - 1), TICK_EDGES)
+    points = np.array(points)
+
+    return {
+        "game": path.name.split(".")[0],
+        "turns": len(points),
+        "points": int(points[-1]) if len(points) else 0,
+        "points_q": [
+            int(points[int(q * (len(points) - 1))]) if len(points) else 0
+            for q in (0.25, 0.5, 0.75)
+        ],
+        "deaths": deaths,
+        "eaten": eaten.tolist(),
+        "ticks": hist,
+        "seconds": perf_counter() - start,
+    }
+
+
+def merge(games: list[dict]) -> dict:
+    return {
+        "game": "total",
+        "turns": sum(g["turns"] for g in games),
+        "points": sum(g["points"] for g in games),
+        "points_q": [None] * 3,
+        "deaths": {
+            f"{g['game']}/{id}": n for g in games for id, n in g["deaths"].items()
+        },
+        "eaten": np.sum([g["eaten"] for g in games], axis=0).tolist(),
+        "ticks": np.sum([g["ticks"] for g in games], axis=0),
+        "seconds": sum(g["seconds"] for g in games),
+    }
+
+
+def row(g: dict) -> dict:
+    deaths = g["deaths"].values()
+    q25, q50, q75 = g["points_q"]
+    return {
+        "game": g["game"],
+        "turns": g["turns"],
+        "points": g["points"],
+        "per_turn": round(g["points"] / g["turns"], 2) if g["turns"] else 0,
+        "q25": q25,
+        "q50": q50,
+        "q75": q75,
+        "deaths": sum(deaths),
+        "worst": max(deaths, default=0),
+        **{f"ate_{t}": n for t, n in zip(FOOD_TYPES, g["eaten"])},
+        "tick_p5": percentile(g["ticks"], 0.05),
+        "tick_p50": percentile(g["ticks"], 0.5),
+        "tick_p95": percentile(g["ticks"], 0.95),
+    }
+
+
+def print_table(rows: list[dict]):
+    columns = list(rows[0])
+    cells = [[("" if r[c] is None else str(r[c])) for c in columns] for r in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.rjust(w) for v, w in zip(r, widths)))
+
+
+def collect(paths: list[Path], workers: int) -> list[dict]:
+    if workers <= 1:
+        return [game_metrics(p) for p in paths]
+
+    ctx = multiprocessing.get_context("spawn")
+    games = []
+    with ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+        jobs = {pool.submit(game_metrics, p): p for p in paths}
+        for job in as_completed(jobs):
+            try:
+                games.append(job.result())
+            except Exception as e:
+                print(f"🥵 {jobs[job]}: {e}")
+                continue
+            g = games[-1]
+            print(f"📊 ➡️ {g['game']}: {g['turns']} turns in {g['seconds']:.1f}s")
+    return games
+
+
+def main(
+    *paths,
+    workers: int = None,
+    snakes: bool = False,
+    out: str = None,
+):
+    """
+    :param paths: replay files or directories of them
+    :param workers: decoding processes, None - one per core, 0 - in process
+    :param snakes: also print deaths per snake
+    :param out: write the summary table to this csv
+    """
+    files = []
+    for path in map(Path, paths or ["data"]):
+        if path.is_dir():
+            found = {f for p in REPLAYS for f in path.glob(p)}
+            # Decision logs of the `flight` recorder are not replays
+            files += sorted(f for f in found if not f.name.endswith(".flight.ljson"))
+        else:
+            files.append(path)
+
+    if not files:
+        print("🥵 No replays found")
+        return
+
+    if workers is None:
+        workers = min(os.cpu_count() or 1, len(files))
+
+    print(f"📊 Analyzing {len(files)} replays with {max(workers, 1)} workers")
+    start = perf_counter()
+
+    games = sorted(collect(files, workers), key=lambda g: g["game"])
+    if not games:
+        return
+
+    rows = [row(g) for g in games] + [row(merge(games))]
+    print_table(rows)
+
+    if snakes and any(g["deaths"] for g in games):
+        print_table(
+            [
+                {"game": g["game"], "snake": id, "deaths": n}
+                for g in games
+                for id, n in sorted(g["deaths"].items())
+            ]
+        )
+
+    if out:
+        with open(out, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"📊 ✅ Summary written to {out}")
+
+    print(f"📊 ✅ Done in {perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    Fire(main)
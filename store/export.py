@@ -0,0 +1,278 @@
+"""
+Replays -> partitioned Parquet (or Arrow) datasets.
+
+Flattens every turn into four tables, one row per turn / snake / food
+item / enemy, so analytics read only the columns they need and skip row
+groups by their turn statistics, no json is decoded at query time.
+
+Layout is hive partitioned by game, one file per game and table:
+
+data/dataset/turns/game=<name>/part-0.parquet
+data/dataset/snakes/game=<name>/part-0.parquet
+data/dataset/food/...
+data/dataset/enemies/...
+
+usage:
+python -m store.export files data/*.ljson
+python -m store.export db --name snake3d-final-5-buft
+
+turns = dataset("turns").to_table(
+    columns=["game", "turn", "points"], filter=pc.field("turn") >= 1000
+)
+"""
+
+from logging import getLogger
+from pathlib import Path
+from typing import Iterable, Iterator, Literal
+
+import numpy as np
+from fire import Fire
+
+from columnar import FOOD_NAMES, ColumnarMap, decoder
+from util.scribe import Scribe
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = getLogger(__name__)
+
+Format = Literal["parquet", "arrow"]
+
+ROOT = Path("data/dataset")
+TABLES = ("turns", "snakes", "food", "enemies")
+
+
+def require():
+    if pa is None:
+        raise ImportError("replay datasets need `pip install pyarrow`")
+
+
+def scribe_worlds(path) -> Iterator[ColumnarMap]:
+    """Any replay `Scribe` reads: plain, compressed or a `replaybin` container"""
+    decode = decoder(True)
+    for data in Scribe(path, enabled=False).payloads():
+        yield decode(data)
+
+
+def db_worlds(name: str, batch: int = 1000) -> Iterator[ColumnarMap]:
+    """Rows of the `replays` table, streamed by a server side cursor"""
+    from store.connect import db
+
+    decode = decoder(True)
+    with db() as conn, conn.cursor("export") as cur:
+        cur.itersize = batch
+        # As text, the json goes to msgspec without a dict tree in between
+        cur.execute(
+            "SELECT data::text FROM replays WHERE name = %s ORDER BY turn", (name,)
+        )
+        for (data,) in cur:
+            yield decode(data)
+
+
+def db_names() -> list[str]:
+    from store.connect import db
+
+    with db() as conn, conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT name FROM replays ORDER BY name")
+        return [name for (name,) in cur.fetchall()]
+
+
+def _heads(offsets: np.ndarray, xyz: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """First point of every geometry and a mask of the empty ones (dead)"""
+    lengths = np.diff(offsets)
+    empty = lengths == 0
+    heads = np.zeros((len(lengths), 3), dtype=xyz.dtype)
+    heads[~empty] = xyz[offsets[:-1][~empty]]
+    return heads, empty
+
+
+def _xyz(prefix: str, xyz: np.ndarray, mask=None) -> dict:
+    return {
+        f"{prefix}{axis}": pa.array(xyz[:, i], mask=mask)
+        for i, axis in enumerate("xyz")
+    }
+
+
+def flatten(worlds: list[ColumnarMap]) -> dict[str, "pa.Table"]:
+    """One table per kind for a chunk of consecutive turns"""
+    turn = np.array([w.turn for w in worlds], dtype=np.int32)
+
+    snakes = np.array([len(w.snake_ids) for w in worlds])
+    food = np.array([len(w.food_xyz) for w in worlds])
+    enemies = np.array([len(w.enemy_status) for w in worlds])
+
+    turns = pa.table(
+        {
+            "turn": turn,
+            "points": np.array([w.points for w in worlds], dtype=np.int32),
+            "tick_remain_ms": np.array(
+                [w.tick_remain_ms for w in worlds], dtype=np.int32
+            ),
+            "revive_timeout": np.array(
+                [w.revive_timeout for w in worlds], dtype=np.int32
+            ),
+            "fences": np.array([len(w.fence_xyz) for w in worlds], dtype=np.int32),
+            "snakes": snakes.astype(np.int32),
+            "food": food.astype(np.int32),
+            "enemies": enemies.astype(np.int32),
+        }
+    )
+
+    def cat(arrays, dtype, width=None):
+        if not arrays:
+            return np.zeros((0, width) if width else 0, dtype=dtype)
+        return np.concatenate(arrays).astype(dtype, copy=False)
+
+    # Snakes
+    heads, empty = zip(*(_heads(w.snake_offsets, w.snake_xyz) for w in worlds))
+    heads, empty = cat(heads, np.int16, 3), cat(empty, bool)
+    revive = [r for w in worlds for r in w.snake_revive]
+    snake_table = pa.table(
+        {
+            "turn": np.repeat(turn, snakes),
+            "snake": pa.array([i for w in worlds for i in w.snake_ids], pa.string()),
+            "status": pa.array(
+                [s for w in worlds for s in w.snake_status], pa.string()
+            ).dictionary_encode(),
+            "deaths": cat([w.snake_deaths for w in worlds], np.int32),
+            "length": cat([np.diff(w.snake_offsets) for w in worlds], np.int32),
+            **_xyz("head_", heads, empty),
+            **_xyz("dir_", cat([w.snake_direction for w in worlds], np.int16, 3)),
+            "revive_remain_ms": pa.array(revive, pa.int32()),
+        }
+    )
+
+    # Food, golden and suspicious items included
+    food_type = cat([w.food_type for w in worlds], np.uint8)
+    food_table = pa.table(
+        {
+            "turn": np.repeat(turn, food),
+            **_xyz("", cat([w.food_xyz for w in worlds], np.int16, 3)),
+            "points": cat([w.food_points for w in worlds], np.int32),
+            "type": pa.DictionaryArray.from_arrays(
+                food_type.astype(np.int8), pa.array(FOOD_NAMES)
+            ),
+            "listed": cat([w.food_listed for w in worlds], bool),
+        }
+    )
+
+    # Enemies, numbered by their position in the turn
+    heads, empty = zip(*(_heads(w.enemy_offsets, w.enemy_xyz) for w in worlds))
+    heads, empty = cat(heads, np.int16, 3), cat(empty, bool)
+    enemy_table = pa.table(
+        {
+            "turn": np.repeat(turn, enemies),
+            "enemy": cat([np.arange(n) for n in enemies], np.int16),
+            "status": pa.array(
+                [s for w in worlds for s in w.enemy_status], pa.string()
+            ).dictionary_encode(),
+            "kills": cat([w.enemy_kills for w in worlds], np.int32),
+            "length": cat([np.diff(w.enemy_offsets) for w in worlds], np.int32),
+            **_xyz("head_", heads, empty),
+        }
+    )
+
+    return {
+        "turns": turns,
+        "snakes": snake_table,
+        "food": food_table,
+        "enemies": enemy_table,
+    }
+
+
+class DatasetWriter:
+    """Streams chunks of one game into its partition of every table"""
+
+    def __init__(self, root: Path, game: str, format: Format = "parquet"):
+        require()
+        self.root = Path(root)
+        self.game = game
+        self.format = format
+        self.writers = {}
+        self.rows = dict.fromkeys(TABLES, 0)
+
+    def path(self, table: str) -> Path:
+        suffix = "parquet" if self.format == "parquet" else "arrow"
+        return self.root / table / f"game={self.game}" / f"part-0.{suffix}"
+
+    def _writer(self, table: str, schema: "pa.Schema"):
+        if table not in self.writers:
+            path = self.path(table)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if self.format == "parquet":
+                # Row groups follow the chunks, turn stats allow skipping them
+                writer = pq.ParquetWriter(path, schema, compression="zstd")
+            else:
+                writer = pa.ipc.new_file(path, schema)
+            self.writers[table] = writer
+        return self.writers[table]
+
+    def write(self, tables: dict[str, "pa.Table"]):
+        for name, table in tables.items():
+            self._writer(name, table.schema).write_table(table)
+            self.rows[name] += len(table)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+def export(
+    worlds: Iterable[ColumnarMap],
+    game: str,
+    root=ROOT,
+    *,
+    format: Format = "parquet",
+    chunk: int = 2048,
+) -> dict[str, int]:
+    """Rows written per table"""
+    writer = DatasetWriter(root, game, format)
+    try:
+        batch = []
+        for world in worlds:
+            batch.append(world)
+            if len(batch) >= chunk:
+                writer.write(flatten(batch))
+                batch = []
+        if batch:
+            writer.write(flatten(batch))
+    finally:
+        writer.close()
+
+    return writer.rows
+
+
+def dataset(table: str, root=ROOT, format: Format = "parquet") -> "ds.Dataset":
+    """Lazy dataset over every game, `game` comes from the partition path"""
+    require()
+    return ds.dataset(
+        Path(root) / table,
+        format="parquet" if format == "parquet" else "ipc",
+        partitioning="hive",
+    )
+
+
+class Export:
+    def files(self, *paths, out=str(ROOT), format: Format = "parquet", chunk=2048):
+        """Exports replay files, the game is named after the file"""
+        for path in map(Path, paths):
+            game = path.name.split(".")[0]
+            print(f"📦 ⬆️ Exporting {path} as `{game}`")
+            rows = export(scribe_worlds(path), game, out, format=format, chunk=chunk)
+            print(f"📦 ✅ {rows}")
+
+    def db(self, name=None, *, out=str(ROOT), format: Format = "parquet", chunk=2048):
+        """Exports the `replays` table, all the games if `name` is None"""
+        for game in [name] if name else db_names():
+            print(f"📦 🛢️ Exporting `{game}`")
+            rows = export(db_worlds(game), game, out, format=format, chunk=chunk)
+            print(f"📦 ✅ {rows}")
+
+
+if __name__ == "__main__":
+    Fire(Export())
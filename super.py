@@ -1,10 +1,7 @@
-import pprint
 from dataclasses import dataclass
-from datetime import datetime
 from logging import basicConfig
-from math import ceil, log2
+from math import log2
 from os import environ
-from time import sleep
 from typing import NamedTuple
 
 import imgui
@@ -13,10 +10,15 @@ from fire import Fire
 
 from client import ApiClient
 from draw import DrawWorld, key_handler, window
-from gameloop import Gameloop, api
-from gt import Map, Snake, Vec3d, parse_map
+from flight import FlightLog, overrun_stages
+from gameloop import AsyncGameloop, Gameloop
+from gt import Map, Snake, SnakeNames, Vec3d, parse_map
+from history import LazyHistory
+from playback import PlaybackWindow, Playhead
+from procloop import RemoteGameloop
 from util.brush import PixelBrush
-from util.itypes import TIMERS, Color, Vec2
+from util.itypes import COUNTERS, TIMERS, Color, Vec2
+from util.rounds import wait_round
 
 basicConfig(
     level="INFO",
@@ -47,20 +49,67 @@ class Super(DrawWorld):
         game_name=None,
         replay_file=None,
         upto=None,
+        start=None,
+        replay_workers=None,
+        aio=False,
+        columnar=False,
+        process=False,
+        hedge=False,
+        history: dict = None,
+        gc_mode=False,
+        compression=None,
+        lazy=False,
+        flight=False,
+        client: ApiClient = None,
     ):
-        super().__init__()
-
-        self.gameloop = Gameloop(
+        """
+        :param client: api client of the live round, the gameloop default if None
+        """
+        options = dict(
             replay_file=replay_file,
             game_name=game_name,
             init=init,
             upto=upto,
-        ).launch_async()
+            start=start,
+            replay_workers=replay_workers,
+            columnar=columnar,
+            history=history,
+            gc_mode=gc_mode,
+            compression=compression,
+            flight=flight,
+        )
+        if not process:
+            # The gameloop process streams decoded worlds to us anyway
+            options["lazy"] = lazy
+
+        # Started before the window, the gameloop process must not inherit it
+        if process:
+            self.gameloop = RemoteGameloop(aio=aio, hedge=hedge, **options)
+        else:
+            gameloop_class = AsyncGameloop if aio else Gameloop
+            self.gameloop = gameloop_class(client=client, **options)
+
+        # Hedging stats of an in-process gameloop
+        self.api = client
+
+        self.gameloop.launch_async()
+
+        super().__init__()
 
         self.wb = self.gameloop.world_builder
         self.config = Config()
 
         self.snake: Snake = None
+        self.names = SnakeNames()
+
+        self.playhead = Playhead()
+        # Decoded turns around the timepoint, lazy replays only
+        self.playback: PlaybackWindow = None
+
+        # Recorded decisions, drawn instead of the live paths in replays
+        self.flight: FlightLog = None
+        if replay_file:
+            self.flight = FlightLog.find(replay_file)
 
     def start(self):
         try:
@@ -70,6 +119,8 @@ class Super(DrawWorld):
         finally:
             self.gameloop.running = False
             self.running = False
+            if self.playback:
+                self.playback.close()
 
     #####
     ###################################
@@ -124,7 +175,7 @@ class Super(DrawWorld):
                 v, z = point.t2()
                 brush.square(g(v), Color.YELLOW.but(a=hide(z)))
 
-        for path in self.gameloop.paths:
+        for path in self.paths_to_draw(world):
             snake = path.snake
             if path.direction.z != 0:
                 brush.image(
@@ -207,7 +258,18 @@ class Super(DrawWorld):
             self.config.timepoint = n
             return world
 
-        return self.wb.history[self.config.timepoint]
+        history = self.wb.history
+        if isinstance(history, LazyHistory):
+            if self.playback is None or self.playback.history is not history:
+                self.playback = PlaybackWindow(history)
+            return self.playback[self.config.timepoint]
+
+        return history[self.config.timepoint]
+
+    def paths_to_draw(self, world: Map):
+        if self.gameloop.paths or not self.flight:
+            return self.gameloop.paths
+        return self.flight.brains(world)
 
     def labeled(self, key, value):
         imgui.text_disabled(f"{key}:")
@@ -241,15 +303,22 @@ class Super(DrawWorld):
 
             _, C.follow = imgui.checkbox("Follow", C.follow)
 
+            gl = self.gameloop
+            _, gl.autopilot = imgui.checkbox("Autopilot", gl.autopilot)
+
         with window("Timers"):
             self.timers()
 
+        if self.flight:
+            with window("Flight"):
+                self.flight_ui(w)
+
         with window("Snakes"):
-            for snake in sorted(w.snakes, key=lambda s: s.name):
+            for snake in sorted(w.snakes, key=self.names):
                 if self.snake and snake == self.snake:
                     imgui.text_colored("You", 0, 255, 0)
 
-                imgui.text(f" Snake: {snake.name}...")
+                imgui.text(f" Snake: {self.names(snake)}...")
                 imgui.text(f"Length: {len(snake.geometry)}")
                 color = Color.GREEN if snake.status == "alive" else Color.RED
                 imgui.text_colored(f"Status: {snake.status}", *color)
@@ -309,6 +378,24 @@ class Super(DrawWorld):
 
             _, C.realtime = imgui.checkbox("Realtime", C.realtime)
 
+            head = self.playhead
+            _, head.playing = imgui.checkbox("Play", head.playing)
+            imgui.same_line()
+            _, head.speed = imgui.slider_float(
+                "Speed", head.speed, -100.0, 100.0, format="%.0f turns/s"
+            )
+
+            if head.playing:
+                C.realtime = False
+            C.timepoint = head.advance(C.timepoint, timelen + 1)
+
+            if self.playback:
+                self.labeled(
+                    "Window",
+                    f"{len(self.playback.worlds)} decoded,"
+                    f" {self.playback.misses} misses",
+                )
+
         self.gameloop.replay_simulate = C.timepoint
 
     @key_handler(pygame.K_MINUS)
@@ -374,6 +461,11 @@ class Super(DrawWorld):
         imgui.same_line()
         imgui.text(self.gameloop.upd.state)
 
+        upd = self.gameloop.upd
+        if upd.state == "Loading":
+            total = f"/{upd.total}" if upd.total else ""
+            self.labeled("Load", f"{upd.loaded}{total}")
+
         imgui.text_disabled("Turn:")
         imgui.same_line()
         imgui.text(f"{self.gameloop.upd.turn}")
@@ -382,6 +474,21 @@ class Super(DrawWorld):
         imgui.same_line()
         imgui.text(f"{self.gameloop.upd.timeout}")
 
+        scheduler = self.gameloop.scheduler
+        imgui.text_disabled("Mrgn:")
+        imgui.same_line()
+        imgui.text(f"{scheduler.margin*1000:.0f}ms, {scheduler.total_overruns} ovr")
+
+        if self.api and self.api.hedging:
+            self.labeled("Hdge", f"{self.api.hedging}")
+
+        clock = self.gameloop.clock
+        if clock.synced:
+            self.labeled("RTT", f"{clock.rtt*1000:.0f}±{clock.rtt_dev*1000:.0f}ms")
+            self.labeled("Tick", f"{(clock.tick or 0)*1000:.0f}ms")
+            self.labeled("Phse", f"{clock.phase()*1000:.0f}ms")
+            self.labeled("Drft", f"{clock.drift*1000:+.1f}ms, {clock.outliers} out")
+
         imgui.text_disabled("Scle:")
         imgui.same_line()
         imgui.text(f"{self.scale:.2f}")
@@ -393,51 +500,103 @@ class Super(DrawWorld):
         if w:
             self.labeled("  KD", f"{w.revive_timeout}")
 
+    def flight_ui(self, w: Map):
+        entry = self.flight.get(w.turn)
+        if not entry:
+            imgui.text_disabled(f"Turn {w.turn} was not planned")
+            return
+
+        color = Color.RED if entry["spent"] > entry["budget"] else Color.GREEN
+        imgui.text_colored(
+            f"Spent {entry['spent']:.1f}ms of {entry['budget']:.1f}ms", *color
+        )
+        self.labeled("Tick", f"{entry['tick']}ms")
+        for name, value in entry["timers"].items():
+            self.labeled(name, f"{value:.2f}ms")
+
+        imgui.separator()
+        late = overrun_stages(entry)
+        for stage in entry["stages"]:
+            owner, name, took, share = stage
+            text = f"{owner} {name}: {took:.2f}ms / {share:.2f}ms"
+            if stage in late:
+                imgui.text_colored(text, *Color.RED)
+            else:
+                imgui.text(text)
+
+        imgui.separator()
+        for snake in entry["snakes"]:
+            self.labeled(snake["id"][:8], snake["thinks"])
+        self.labeled("Banned", f"{len(entry['banned'])}")
+
     def timers(self):
         for name, value in TIMERS.items():
             imgui.text_disabled(f"{name}:")
             imgui.same_line()
             imgui.text(f"{value*1000:.2f}ms")
 
+        for name, value in COUNTERS.items():
+            imgui.text_disabled(f"{name}:")
+            imgui.same_line()
+            imgui.text(f"{value}")
+
+
+def main(
+    replay_file=None,
+    *,
+    upto: int = None,
+    start: int = None,
+    replay_workers: int = None,
+    aio: bool = False,
+    hedge: bool = False,
+    columnar: bool = False,
+    process: bool = False,
+    max_turns: int = None,
+    keyframe_every: int = 100,
+    gc_mode: bool = False,
+    compression: str = None,
+    lazy: bool = False,
+    flight: bool = False,
+):
+    """
+    :param lazy: replay turns are decoded only when drawn
+    :param flight: record the decisions of live rounds, see `flight`
+    """
+    history = dict(max_turns=max_turns, keyframe_every=keyframe_every)
 
-def main(replay_file=None, *, upto: int = None):
     if replay_file:
-        Super(replay_file=replay_file, upto=upto).start()
+        Super(
+            replay_file=replay_file,
+            upto=upto,
+            start=start,
+            replay_workers=replay_workers,
+            columnar=columnar,
+            process=process,
+            history=history,
+            gc_mode=gc_mode,
+            lazy=lazy,
+        ).start()
     else:
-        rounds = api.rounds()
-        rounds["rounds"] = [r for r in rounds["rounds"] if r["status"] != "ended"]
-
-        actives = [r for r in rounds["rounds"] if r["status"] == "active"]
-
-        if len(actives) == 0:
-            pprint.pprint(rounds)
-            print("No active games")
-
-            now = datetime.fromisoformat(rounds["now"])
-            closest = min(
-                rounds["rounds"],
-                key=lambda r: abs(datetime.fromisoformat(r["startAt"]) - now),
-            )
-
-            start_in = datetime.fromisoformat(closest["startAt"]) - now
-
-            print(
-                f"Next game: {closest['name']} at {closest['startAt']} (in {start_in})"
-            )
-
-            seconds = ceil(start_in.total_seconds())
-
-            print(f"Sleeping for {seconds} seconds")
-            sleep(seconds)
-            return main()
-
-        active = actives[0]
+        api = ApiClient("prod", hedge=hedge)
+        active = wait_round(api, ready=api.warmup)
 
         name = active["name"]
         print(f"🚀 Playing round: {name}")
 
         m = parse_map(ApiClient("test").world())
-        sup = Super(game_name=f"{name}-" + environ.get("USER", "dashik"), init=m)
+        sup = Super(
+            game_name=f"{name}-" + environ.get("USER", "dashik"),
+            init=m,
+            aio=aio,
+            columnar=columnar,
+            process=process,
+            hedge=hedge,
+            history=history,
+            gc_mode=gc_mode,
+            compression=compression,
+            flight=flight,
+            client=api,
+        )
         sup.start()
 
 
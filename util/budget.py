@@ -0,0 +1,233 @@
+import heapq
+import itertools
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+
+from util.itypes import COUNTERS, TIMERS
+
+
+def percentile(samples: Iterable[float], q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Scheduler:
+    """
+    Owns the turn deadline.
+
+    Learns how long the network call takes (to keep a safety margin)
+    and how long every planning stage takes (to split the turn fairly).
+
+    usage:
+    budget = scheduler.turn(world.tick_remain_ms)
+    for snake, sb in budget.split(snakes, key=lambda s: s.id):
+        with sb.stage("astar", share=0.8) as seconds:
+            ...
+    """
+
+    def __init__(
+        self,
+        *,
+        quantile=0.95,
+        window=200,
+        smoothing=0.2,
+        reserve=0.02,
+    ):
+        self.quantile = quantile
+        self.smoothing = smoothing
+        self.reserve = reserve
+
+        self.latency = deque(maxlen=window)
+        self.costs: dict[str, float] = {}
+        self.overruns: dict[str, int] = defaultdict(int)
+
+    def observe_network(self, seconds: float):
+        self.latency.append(seconds)
+
+    @property
+    def margin(self) -> float:
+        """Time kept for the next network call, learned from past calls"""
+        return max(self.reserve, percentile(self.latency, self.quantile))
+
+    def turn(self, tick_remain_ms: float, margin: float = None) -> "TurnBudget":
+        if margin is None:
+            margin = self.margin
+
+        seconds = max(0.0, tick_remain_ms / 1000 - margin)
+        return TurnBudget(self, perf_counter() + seconds)
+
+    def cost(self, name: str, default=0.0) -> float:
+        return self.costs.get(name, default)
+
+    def record(self, name: str, spent: float, budget: float):
+        previous = self.costs.get(name)
+        if previous is None:
+            self.costs[name] = spent
+        else:
+            self.costs[name] = previous + self.smoothing * (spent - previous)
+
+        if spent > budget:
+            self.overruns[name] += 1
+            TIMERS[f"overrun {name}"] = spent - budget
+
+    @property
+    def total_overruns(self) -> int:
+        return sum(self.overruns.values())
+
+
+class TurnBudget:
+    def __init__(self, scheduler: Scheduler, deadline: float):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.start = perf_counter()
+
+        # (owner, stage, spent, budget) of this turn, see `flight`
+        self.stages: list[tuple[str, str, float, float]] = []
+
+    @property
+    def seconds(self) -> float:
+        return max(0.0, self.deadline - perf_counter())
+
+    def split(
+        self,
+        items: list,
+        key: Callable = str,
+        priority: Callable = lambda item: 1.0,
+        *,
+        headroom=2.0,
+        floor=0.005,
+    ) -> Iterator[tuple]:
+        """
+        Yields `(item, SnakeBudget)` one by one.
+
+        Every item gets a slice of what is left of the turn, weighted by
+        its priority only. The cost on previous turns (times `headroom`,
+        at least `floor` seconds) caps the slice, so time a cheap item
+        does not need goes to the ones after it. The cost never shrinks
+        a slice below the fair share otherwise: it is measured against
+        the slice it was given, weighting by it would starve an item
+        that once got little time.
+        """
+        weights = [priority(item) for item in items]
+
+        for i, item in enumerate(items):
+            name = f"snake {key(item)}"
+            seconds = self.seconds * weights[i] / (sum(weights[i:]) or 1)
+
+            cost = self.scheduler.cost(name, None)
+            if cost:
+                seconds = min(seconds, max(cost * headroom, floor))
+
+            sb = SnakeBudget(self, name, seconds)
+
+            yield item, sb
+
+            sb.close()
+
+    def fixed(self, name: str, share=1.0) -> "SnakeBudget":
+        return SnakeBudget(self, name, self.seconds * share)
+
+    def record(self, owner: str, name: str, spent: float, budget: float):
+        self.stages.append((owner, name, spent, budget))
+        self.scheduler.record(name, spent, budget)
+
+
+class SnakeBudget:
+    def __init__(self, turn: TurnBudget, name: str, seconds: float):
+        self.turn = turn
+        self.name = name
+        self.budget = seconds
+
+        self.start = perf_counter()
+        self.deadline = min(turn.deadline, self.start + seconds)
+
+    @property
+    def seconds(self) -> float:
+        return max(0.0, self.deadline - perf_counter())
+
+    @contextmanager
+    def stage(self, name: str, share=1.0):
+        """Yields seconds available for the stage, records its cost"""
+        budget = self.seconds * share
+        start = perf_counter()
+        try:
+            yield budget
+        finally:
+            self.turn.record(self.name, name, perf_counter() - start, budget)
+
+    def close(self):
+        spent = perf_counter() - self.start
+        self.turn.record(self.name, self.name, spent, self.budget)
+
+
+class DeadlinePool:
+    """
+    Planning workers shared by several gameloops.
+
+    Jobs run earliest deadline first: with more sessions than workers,
+    the turn that ends soonest gets the CPU. A job that starts after its
+    deadline still runs, its commands ride the next request.
+
+    usage:
+    pool = DeadlinePool(4)
+    pool.submit(budget.deadline, plan, world, budget).result()
+    """
+
+    def __init__(self, workers=1):
+        self.queue: list[tuple] = []
+        self.ready = threading.Condition()
+        self.order = itertools.count()
+        self.running = True
+        self.late = 0
+
+        self.threads = [
+            threading.Thread(target=self._work, name=f"planner-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, deadline: float, fn: Callable, *args) -> Future:
+        future = Future()
+        with self.ready:
+            heapq.heappush(self.queue, (deadline, next(self.order), future, fn, args))
+            self.ready.notify()
+        return future
+
+    def _work(self):
+        while True:
+            with self.ready:
+                while self.running and not self.queue:
+                    self.ready.wait()
+                if not self.running:
+                    return
+
+                deadline, _, future, fn, args = heapq.heappop(self.queue)
+                COUNTERS["planner queue"] = len(self.queue)
+
+                # Workers share the counter, it only changes under the lock
+                if perf_counter() > deadline and not future.cancelled():
+                    self.late += 1
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self):
+        with self.ready:
+            self.running = False
+            for _, _, future, _, _ in self.queue:
+                future.cancel()
+            self.queue.clear()
+            self.ready.notify_all()
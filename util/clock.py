@@ -0,0 +1,109 @@
+from collections import deque
+from statistics import median
+from time import perf_counter
+
+from util.budget import percentile
+
+
+class TickClock:
+    """
+    Estimates the server tick phase from our own requests.
+
+    Every `api.world` response tells how much of the tick is left
+    (`tickRemainMs`). With the local send/receive timestamps it gives the
+    local time of the next tick boundary, assuming the server answered in
+    the middle of the round trip.
+
+    All times are `perf_counter()` seconds.
+    """
+
+    def __init__(self, *, alpha=0.2, window=100, reject=4.0, guard=0.01):
+        self.alpha = alpha
+        self.reject = reject
+        self.guard = guard
+
+        self.rtts = deque(maxlen=window)
+        self.rtt = None
+        self.rtt_dev = 0.0
+
+        self.tick = None
+        self.drift = 0.0
+        self.boundary = None
+        self.turn = None
+
+        self.samples = 0
+        self.outliers = 0
+
+    def _ewma(self, old, new):
+        if old is None:
+            return new
+        return old + self.alpha * (new - old)
+
+    def is_outlier(self, rtt: float) -> bool:
+        if len(self.rtts) < 5:
+            return False
+
+        mid = median(self.rtts)
+        mad = median(abs(r - mid) for r in self.rtts) or 0.001
+        return rtt > mid + self.reject * mad
+
+    def observe(self, sent: float, received: float, turn: int, tick_remain_ms: int):
+        rtt = received - sent
+        self.samples += 1
+
+        if self.is_outlier(rtt):
+            # Slow answer, the server moment inside it is unknown
+            self.outliers += 1
+            self.rtts.append(rtt)
+            return
+
+        self.rtts.append(rtt)
+        self.rtt_dev = self._ewma(self.rtt_dev, abs(rtt - (self.rtt or rtt)))
+        self.rtt = self._ewma(self.rtt, rtt)
+
+        boundary = sent + rtt / 2 + tick_remain_ms / 1000
+
+        if self.boundary is not None and self.turn is not None and turn > self.turn:
+            tick = (boundary - self.boundary) / (turn - self.turn)
+            self.tick = self._ewma(self.tick, tick)
+
+            predicted = self.boundary + (turn - self.turn) * self.tick
+            self.drift = self._ewma(self.drift, boundary - predicted)
+            boundary = predicted + self.alpha * (boundary - predicted)
+
+        self.boundary = boundary
+        self.turn = turn
+
+    @property
+    def synced(self) -> bool:
+        return self.boundary is not None
+
+    def next_boundary(self, now: float = None) -> float:
+        now = perf_counter() if now is None else now
+
+        boundary = self.boundary
+        if self.tick:
+            while boundary < now:
+                boundary += self.tick
+
+        return boundary
+
+    def send_at(self, now: float = None) -> float:
+        """Local time to send, so the request lands just after the boundary"""
+        boundary = self.next_boundary(now)
+        return boundary - self.rtt / 2 + self.guard + self.rtt_dev
+
+    def wake_in(self, default: float, now: float = None) -> float:
+        if not self.synced:
+            return max(0.0, default)
+
+        now = perf_counter() if now is None else now
+        return max(0.0, self.send_at(now) - now)
+
+    def phase(self, now: float = None) -> float:
+        """Seconds left to the next tick boundary"""
+        now = perf_counter() if now is None else now
+        return self.next_boundary(now) - now
+
+    def rtt_percentile(self, q: float) -> float:
+        return percentile(self.rtts, q)
@@ -0,0 +1,159 @@
+"""
+Compressed replay streams.
+
+Replays repeat the whole world every turn, a compressor that sees the
+previous turn (zstd, its window is megabytes) shrinks them by an order
+of magnitude, gzip only sees the last 32KB and does a few times less.
+
+Streams are append friendly: the writer flushes whole blocks (zstd) or
+sync points (gzip), so a file being recorded can be read up to the last
+flush. Readers detect the format by magic bytes, plain json lines just
+pass through.
+
+usage:
+with open_append(path, "zstd") as f:
+    f.write(line)
+
+with open_read(path) as f:
+    for line in f:
+        ...
+"""
+
+import gzip
+import io
+import zlib
+from pathlib import Path
+from typing import Literal
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+Compression = Literal["gzip", "zstd"] | None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+SUFFIX = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def detect(path: Path) -> Compression:
+    with open(path, "rb") as f:
+        head = f.read(4)
+
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    if head.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def require(compression: Compression):
+    if compression == "zstd" and zstandard is None:
+        raise ImportError("zstd replays need `pip install zstandard`")
+
+
+class AppendStream:
+    """Binary append stream, `flush` makes everything written so far readable"""
+
+    def __init__(self, path: Path, compression: Compression = None, level=None):
+        require(compression)
+
+        self.compression = compression
+        self.raw = open(path, "ab")
+
+        if compression == "gzip":
+            self.stream = gzip.GzipFile(
+                fileobj=self.raw, mode="ab", compresslevel=level or 6
+            )
+        elif compression == "zstd":
+            cctx = zstandard.ZstdCompressor(level=level or 3)
+            self.stream = cctx.stream_writer(self.raw, closefd=False)
+        else:
+            self.stream = self.raw
+
+    def write(self, data: bytes):
+        self.stream.write(data)
+
+    def flush(self):
+        # gzip: Z_SYNC_FLUSH, zstd: end of block, the frame stays open
+        self.stream.flush()
+        self.raw.flush()
+
+    def fileno(self) -> int:
+        return self.raw.fileno()
+
+    def close(self):
+        if self.stream is not self.raw:
+            self.stream.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_append(path: Path, compression: Compression = None, level=None):
+    return AppendStream(path, compression, level)
+
+
+class Inflate(io.RawIOBase):
+    """
+    gzip reader for possibly unfinished files.
+
+    `gzip.open` raises on a stream without its trailer and drops the
+    last decoded chunk, this one returns everything up to the last flush.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.inflate = zlib.decompressobj(wbits=31)
+        self.buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buffer:
+            chunk = self.f.read(1 << 16)
+            if not chunk:
+                return 0
+
+            data = self.inflate.decompress(chunk)
+            # Every recording session appends its own gzip member
+            while self.inflate.eof and self.inflate.unused_data:
+                rest = self.inflate.unused_data
+                self.inflate = zlib.decompressobj(wbits=31)
+                data += self.inflate.decompress(rest)
+            if self.inflate.eof:
+                self.inflate = zlib.decompressobj(wbits=31)
+
+            self.buffer = data
+
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+def open_read(path: Path) -> io.BufferedIOBase:
+    """Decompressing binary reader, iterates over lines"""
+    compression = detect(path)
+    require(compression)
+
+    if compression == "gzip":
+        return io.BufferedReader(Inflate(open(path, "rb")))
+
+    if compression == "zstd":
+        dctx = zstandard.ZstdDecompressor()
+        reader = dctx.stream_reader(open(path, "rb"), read_across_frames=True)
+        return io.BufferedReader(reader)
+
+    return open(path, "rb")
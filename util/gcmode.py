@@ -0,0 +1,149 @@
+import gc
+from contextlib import contextmanager
+from logging import getLogger
+from time import perf_counter
+
+from util.itypes import TIMERS
+
+logger = getLogger(__name__)
+
+# Third threshold, gen 2 only runs when we ask for it
+NEVER = 1_000_000_000
+
+
+@contextmanager
+def paused():
+    """
+    No automatic collections inside. For bursts of acyclic objects that
+    are kept, decoded worlds: every collection would scan all of them.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class GcGuard:
+    """
+    Keeps full garbage collections out of the planning window.
+
+    - long-lived objects (modules, round data) are frozen at start and
+      once more after `warmup` turns, collections never scan them again
+    - automatic full (gen 2) collections are switched off, young ones stay
+    - the idle sleep window collects the young generations, and every
+      `full_every` turns a full collection if it fits there
+    - no idle window for `full_every` turns (the planner always ran into
+      the sleep) gives automatic full collections back until the next one
+    - every collector pause is recorded, per turn, into `TIMERS`
+
+    usage:
+    guard = GcGuard(enabled=True).start()
+    guard.begin_turn()
+    ... plan ...
+    sleep(wake - guard.idle(wake))
+    """
+
+    def __init__(self, enabled=False, young=(10_000, 20), warmup=50, full_every=100):
+        self.enabled = enabled
+        self.young = young
+        self.warmup = warmup
+        self.full_every = full_every
+
+        self.started = None
+        self.pause = 0.0
+        self.full = 0.0  # latest full collection duration
+        self.collections = 0
+
+        self.turns = 0
+        self.last_full = 0
+        self.last_idle = 0
+        self.warm = False
+        self.thresholds = None
+        # Automatic full collections are back on, no idle window came
+        self.fallback = False
+
+    def _callback(self, phase, info):
+        if phase == "start":
+            self.started = perf_counter()
+        elif self.started is not None:
+            self.pause += perf_counter() - self.started
+            self.collections += 1
+            self.started = None
+
+    def start(self):
+        if not self.enabled:
+            return self
+
+        self.thresholds = gc.get_threshold()
+        gc.collect()
+        gc.freeze()
+
+        gc.set_threshold(*self.young, NEVER)
+        gc.callbacks.append(self._callback)
+
+        logger.info(f"🧹 GC mode on, {gc.get_freeze_count()} objects frozen")
+        return self
+
+    def stop(self):
+        if not self.enabled:
+            return
+
+        if self._callback in gc.callbacks:
+            gc.callbacks.remove(self._callback)
+        gc.set_threshold(*self.thresholds)
+        gc.unfreeze()
+
+    def begin_turn(self):
+        if not self.enabled:
+            return
+
+        TIMERS["gc pause"] = self.pause
+        self.pause = 0.0
+        self.turns += 1
+
+        if not self.fallback and self.turns - self.last_idle > self.full_every:
+            gc.set_threshold(*self.young, self.thresholds[2])
+            self.fallback = True
+            logger.warning(f"🧹 No idle window for {self.full_every} turns")
+
+    def idle(self, seconds: float) -> float:
+        """
+        Collects in `seconds` of idle time: once after the warmup turns
+        everything that survives is frozen, the round data is built by
+        then. Freezing after every collection would keep short lived
+        garbage forever.
+
+        :return: seconds spent
+        """
+        if not self.enabled:
+            return 0.0
+
+        warm = not self.warm and self.turns >= self.warmup
+        due = self.turns - self.last_full >= self.full_every
+        full = warm or (due and seconds > 2 * self.full)
+
+        self.last_idle = self.turns
+        if self.fallback:
+            gc.set_threshold(*self.young, NEVER)
+            self.fallback = False
+
+        start = perf_counter()
+        pause = self.pause
+        if full:
+            gc.collect()
+            if warm:
+                gc.freeze()
+                self.warm = True
+                logger.info(f"🧹 Warmed up, {gc.get_freeze_count()} objects frozen")
+            self.full = perf_counter() - start
+            self.last_full = self.turns
+        else:
+            gc.collect(1)
+        self.pause = pause
+
+        spent = perf_counter() - start
+        TIMERS["gc idle"] = spent
+        return spent
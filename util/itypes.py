@@ -2,8 +2,6 @@ from contextlib import contextmanager
 from time import perf_counter
 from typing import NamedTuple
 
-import imgui
-
 
 class Vec2(NamedTuple):
     x: float
@@ -88,6 +86,9 @@ class Color(NamedTuple):
     a: float
 
     def int(self) -> int:
+        # Imported here, headless runs never load graphics
+        import imgui
+
         return imgui.get_color_u32_rgba(*self)
 
     def but(self, **kwargs) -> "Color":
@@ -166,6 +167,8 @@ def clump(minimum, value, maximum):
 
 
 TIMERS = {}
+# Sizes and counts, shown next to the timers but not in ms
+COUNTERS = {}
 
 
 @contextmanager
@@ -0,0 +1,47 @@
+import pprint
+from datetime import datetime
+from time import sleep
+
+from client import ApiClient
+
+
+def wait_round(client: ApiClient, lead: float = 0.0, ready=None) -> dict:
+    """
+    Blocks until a round is active, returns it.
+
+    :param lead: seconds before `startAt` to wake up and start polling
+    :param ready: called once, `lead` seconds before the start at the latest,
+        e.g. `client.warmup`
+    """
+    while True:
+        rounds = client.rounds()
+        rounds["rounds"] = [r for r in rounds["rounds"] if r["status"] != "ended"]
+
+        actives = [r for r in rounds["rounds"] if r["status"] == "active"]
+        if actives:
+            if ready:
+                ready()
+            return actives[0]
+
+        pprint.pprint(rounds)
+        print("No active games")
+
+        now = datetime.fromisoformat(rounds["now"])
+        closest = min(
+            rounds["rounds"],
+            key=lambda r: abs(datetime.fromisoformat(r["startAt"]) - now),
+        )
+
+        start_in = datetime.fromisoformat(closest["startAt"]) - now
+        print(f"Next game: {closest['name']} at {closest['startAt']} (in {start_in})")
+
+        # Within the lead, get ready while the round has not started yet
+        if ready and start_in.total_seconds() <= lead:
+            ready()
+            ready = None
+
+        # Close to the start only poll, the status flips any moment now
+        seconds = max(0.5, start_in.total_seconds() - lead)
+
+        print(f"Sleeping for {seconds:.1f} seconds")
+        sleep(seconds)
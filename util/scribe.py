@@ -1,13 +1,201 @@
+import atexit
 import itertools
 import json
+import os
+import sys
+import threading
 from logging import getLogger
 from pathlib import Path
+from queue import Empty, Full, Queue
+from time import perf_counter
+from typing import Callable, Literal
 
 from fire import Fire
 
+import replaybin
+from columnar import ColumnarMap, encode_wire
+from util import codec
+from util.itypes import COUNTERS, TIMERS
+from util.turnindex import IndexWriter, TurnIndex, turn_of
+
 logger = getLogger(__name__)
 
 
+class LineSink:
+    """Json lines, optionally compressed, indexed when plain"""
+
+    def __init__(
+        self,
+        path: Path,
+        compression: codec.Compression = None,
+        level: int = None,
+        index=True,
+    ):
+        """
+        :param index: keep the `util.turnindex` sidecar, plain files only
+        """
+        self.index = None
+        if index and compression is None:
+            self.index = IndexWriter(path, path.stat().st_size if path.exists() else 0)
+
+        self.file = codec.open_append(path, compression, level)
+
+    def write_batch(self, lines: list[bytes]):
+        self.file.write(b"".join(line + b"\n" for line in lines))
+        if self.index:
+            for line in lines:
+                self.index.add(line)
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def flush(self):
+        self.file.flush()
+        if self.index:
+            self.index.flush()
+
+    def close(self):
+        self.file.close()
+        if self.index:
+            self.index.close()
+
+
+class BackgroundWriter:
+    """
+    Writes payloads to a sink from its own thread.
+
+    The caller only puts the payload into a bounded queue, encoding and
+    writing happen in batches on the writer thread, the file stays open.
+    The caller never waits: when the queue is full, or the writer died on
+    an error, payloads are dropped and counted in `dropped`.
+
+    sink - `LineSink` or `replaybin.ColumnarWriter`
+
+    fsync:
+    - "never" - leave it to the OS
+    - "flush" - on every flush, every `flush_every` seconds at most
+    - "close" - once, when the writer is closed
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        sink,
+        encode: Callable[[object], bytes],
+        *,
+        queue_size=1024,
+        flush_every=0.5,
+        fsync: Literal["never", "flush", "close"] = "close",
+    ):
+        self.path = path
+        self.sink = sink
+        self.encode = encode
+        self.flush_every = flush_every
+        self.fsync = fsync
+
+        self.queue = Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+        # The error that stopped the writer thread
+        self.error: Exception = None
+
+        self.thread = threading.Thread(
+            target=self._run, name=f"writer {path.name}", daemon=True
+        )
+        self.thread.start()
+
+    @property
+    def alive(self) -> bool:
+        return self.error is None and self.thread.is_alive()
+
+    def write(self, data):
+        if self.error is not None:
+            self.dropped += 1
+            return
+
+        try:
+            self.queue.put_nowait((perf_counter(), data))
+        except Full:
+            # Only when the disk can not keep up, the turn never waits for it
+            self.dropped += 1
+            if self.dropped == 1:
+                logger.warning(f"📁 Writer is behind, dropping: {self.path}")
+        COUNTERS["writer dropped"] = self.dropped
+
+    def _drain(self, first) -> list:
+        batch = [first]
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                return batch
+
+    def _run(self):
+        try:
+            self._loop()
+        except Exception as e:
+            self.error = e
+            logger.error(f"📁 Writer stopped, dropping: {self.path}", exc_info=e)
+        finally:
+            try:
+                self.sink.close()
+            except Exception as e:
+                logger.error(f"📁 Writer could not close {self.path}", exc_info=e)
+
+        if self.error is None and self.fsync != "never":
+            with self.path.open("rb") as f:
+                os.fsync(f.fileno())
+
+    def _loop(self):
+        flushed = perf_counter()
+
+        while True:
+            try:
+                batch = self._drain(self.queue.get(timeout=self.flush_every))
+            except Empty:
+                batch = []
+
+            stop = None in batch
+            items = [item for item in batch if item is not None]
+
+            if items:
+                self.sink.write_batch([self.encode(d) for _, d in items])
+                now = perf_counter()
+                TIMERS["writer latency"] = now - items[0][0]
+                COUNTERS["writer queue"] = self.queue.qsize()
+
+            now = perf_counter()
+            if stop or now - flushed >= self.flush_every:
+                self.sink.flush()
+                if self.fsync == "flush":
+                    os.fsync(self.sink.fileno())
+                flushed = now
+
+            if stop:
+                return
+
+    def close(self, timeout=10.0):
+        """
+        Writes everything queued, then closes the file.
+        Gives up after `timeout` seconds, a dead writer is not waited for.
+        """
+        if self.closed:
+            return
+
+        self.closed = True
+        try:
+            if self.thread.is_alive():
+                self.queue.put(None, timeout=timeout)
+        except Full:
+            pass
+
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logger.warning(f"📁 Writer did not finish in {timeout}s: {self.path}")
+        if self.dropped:
+            logger.warning(f"📁 {self.dropped} payloads dropped: {self.path}")
+
+
 class Scribe:
     """
     Dump server world state to a file.
@@ -23,17 +211,61 @@ class Scribe:
     # def decode(self, data):
     #     return pickle.loads(b64decode(data))
 
-    def encode(self, data):
-        return json.dumps(data, ensure_ascii=True)
+    def encode(self, data) -> bytes | ColumnarMap:
+        if isinstance(data, ColumnarMap):
+            # Container sinks take worlds, see `dump_world`
+            return data
+
+        if isinstance(data, (bytes, bytearray)):
+            # Raw server response, json never needs a newline outside strings
+            if b"\n" in data:
+                data = data.replace(b"\n", b"")
+            return data
+
+        return json.dumps(data, ensure_ascii=True).encode()
 
     def decode(self, data):
         return json.loads(data)
 
     #
 
-    def __init__(self, path: str, *, enabled=True, **kwargs):
+    def __init__(
+        self,
+        path: str,
+        *,
+        enabled=True,
+        background=True,
+        flush_every=0.5,
+        fsync="close",
+        compression: codec.Compression | Literal["columnar"] = None,
+        level: int = None,
+        **kwargs,
+    ):
+        """
+        :param background: write from a `BackgroundWriter` thread
+        :param flush_every: seconds between flushes, background only
+        :param fsync: "never", "flush" or "close", see `BackgroundWriter`
+        :param compression: "gzip" or "zstd" recording, adds the file suffix,
+            "columnar" records a `replaybin` container instead of json lines
+        """
         self.replay = Path(path)
+        if enabled and compression == "columnar":
+            if not background:
+                raise ValueError("Columnar recording needs the background writer")
+            self.replay = self.replay.with_suffix(".rcol")
+        elif enabled and compression:
+            suffix = codec.SUFFIX[compression]
+            if self.replay.suffix != suffix:
+                self.replay = self.replay.with_name(self.replay.name + suffix)
+
         self.enabled = enabled
+        self.background = background
+        self.compression = compression
+        self.level = level
+        self.writer_options = dict(flush_every=flush_every, fsync=fsync)
+        self.writer: BackgroundWriter = None
+        # Foreground recording, one gzip member / zstd frame for the session
+        self.stream: codec.AppendStream = None
         self.kwargs = kwargs
         if not self.enabled:
             if not self.replay.is_file():
@@ -44,45 +276,171 @@ class Scribe:
             logger.info(f"📁 ✍️ Scribe recording: {self.replay}")
             self.replay.touch()
 
-    def dump_world(self, world_supplier):
+    def dump_world(self, world_supplier, world=None):
+        """
+        :param world: the payload decoded already, a `ColumnarMap` goes into
+            a container as it is instead of being decoded again
+        """
         if not self.enabled:
             return
 
-        data = self.encode(world_supplier())
-        with self.replay.open("a") as f:
-            print(data, file=f)
+        if not self.background:
+            if self.stream is None:
+                self.stream = codec.open_append(
+                    self.replay, self.compression, self.level
+                )
+                atexit.register(self.stream.close)
+
+            self.stream.write(self.encode(world_supplier()) + b"\n")
+            # Readable right away, the stream itself stays open
+            self.stream.flush()
+            return
+
+        if self.writer is None:
+            if self.compression == "columnar":
+                sink = replaybin.ColumnarWriter(self.replay, level=self.level or 3)
+            else:
+                sink = LineSink(self.replay, self.compression, self.level)
+
+            self.writer = BackgroundWriter(
+                self.replay, sink, self.encode, **self.writer_options
+            )
+            atexit.register(self.writer.close)
+
+        if self.compression == "columnar" and isinstance(world, ColumnarMap):
+            self.writer.write(world)
+        else:
+            self.writer.write(world_supplier())
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            atexit.unregister(self.writer.close)
+            self.writer = None
+        if self.stream is not None:
+            self.stream.close()
+            atexit.unregister(self.stream.close)
+            self.stream = None
 
     def _cleanup_replay(self):
         if not self.enabled:
             return
 
         logger.info(f"📁 Replay file: {self.replay}")
+        self.close()
         if self.replay.exists():
             self.replay.unlink()
             self.replay.touch()
             logger.info("🧹 Replay file cleaned")
 
-    def replay_iterator(self):
+    def replay_iterator(self, raw=False):
+        """
+        :param raw: yield lines as bytes, without decoding
+
+        `start` (turn) and `upto` (turns from there) come from the constructor.
+        Worlds of `replaybin` containers are encoded back to json lines,
+        `payloads` hands them out as they are.
+        """
+        for payload in self.payloads():
+            if isinstance(payload, ColumnarMap):
+                payload = encode_wire(payload)
+            yield payload if raw else self.decode(payload)
+
+    def payloads(self):
+        """
+        Lines as bytes, or `ColumnarMap` worlds of a `replaybin` container,
+        no json involved. Either goes to `columnar.decoder`.
+        """
         upto = self.kwargs.get("upto")
+        start = self.kwargs.get("start")
+
+        if replaybin.is_container(self.replay):
+            replay = replaybin.ColumnarReplay(self.replay)
+            worlds = replay.range(start)
+            if upto:
+                worlds = itertools.islice(worlds, upto)
+            yield from worlds
+            replay.close()
+            return
+
+        plain = codec.detect(self.replay) is None
+
+        # Compressed streams are detected by their magic bytes
+        with codec.open_read(self.replay) as replay:
+            if start and plain:
+                index = TurnIndex.open(self.replay)
+                replay.seek(index.offset(start))
+                index.close()
 
-        with self.replay.open("r") as replay:
-            lines = filter(bool, map(str.strip, replay))
+            lines = filter(bool, map(bytes.strip, replay))
+
+            if start and not plain:
+                # No offsets inside a compressed stream, skip up to it
+                before = lambda line: turn_of(line, start) < start  # noqa: E731
+                lines = itertools.dropwhile(before, lines)
 
             if upto:
                 lines = itertools.islice(lines, upto)
 
-            for line in lines:
-                yield self.decode(line)
+            yield from lines
 
 
 def test(file):
     scribe = Scribe(file)
 
     scribe.dump_world(lambda: {"a": 1})
+    scribe.close()
 
     for item in scribe.replay_iterator():
         print(item)
 
 
+def convert(src, dst=None, compression="zstd", level=None):
+    """
+    Rewrites a replay with another compression, `None` for plain json lines.
+
+    usage:
+    python -m util.scribe convert data/round.ljson
+    """
+    source = Scribe(src, enabled=False)
+
+    dst = Path(dst or str(src).removesuffix(".gz").removesuffix(".zst"))
+    if compression:
+        dst = dst.with_name(dst.name + codec.SUFFIX[compression])
+    if dst.resolve() == source.replay.resolve():
+        raise ValueError(f"Refusing to overwrite the source: {dst}")
+
+    dst.unlink(missing_ok=True)
+
+    turns = 0
+    with codec.open_append(dst, compression, level) as out:
+        for line in source.replay_iterator(raw=True):
+            out.write(line + b"\n")
+            turns += 1
+
+    before, after = source.replay.stat().st_size, dst.stat().st_size
+    print(
+        f"📁 {turns} turns, {before / 2**20:.1f}MB -> {after / 2**20:.1f}MB"
+        f" (x{before / max(after, 1):.1f}): {dst}"
+    )
+
+
+def index(src):
+    """
+    Builds or completes the turn index of a plain replay.
+
+    usage:
+    python -m util.scribe index data/round.ljson
+    """
+    turns = TurnIndex.open(src)
+    print(f"📇 {len(turns)} turns indexed: {src}")
+    turns.close()
+
+
+COMMANDS = {"test": test, "convert": convert, "index": index}
+
 if __name__ == "__main__":
-    Fire(test)
+    # `python -m util.scribe <file>` is still `test`
+    if len(sys.argv) > 1 and sys.argv[1] not in {*COMMANDS, "-h", "--help"}:
+        sys.argv.insert(1, "test")
+    Fire(COMMANDS)
@@ -0,0 +1,186 @@
+"""
+Sidecar turn index for plain replay files.
+
+`<replay>.idx` holds one `(turn, offset, length)` row per line of the
+replay, written by the recorder as it goes, or built by one scan of an
+existing file. `TurnIndex` memory-maps the replay and slices any turn
+or range out of it directly, nothing before it is read or parsed.
+
+Compressed replays have no byte offsets to jump to, they are not indexed.
+
+usage:
+index = TurnIndex.open("data/round.ljson")
+raw = index.raw(20_000)
+for raw in index.range(20_000, 20_100):
+    ...
+"""
+
+import mmap
+import re
+from logging import getLogger
+from pathlib import Path
+
+import numpy as np
+
+logger = getLogger(__name__)
+
+ROW = np.dtype([("turn", "<i4"), ("offset", "<i8"), ("length", "<i4")])
+
+TURN = re.compile(rb'"turn":\s*(-?\d+)')
+
+
+def index_path(replay: Path) -> Path:
+    return replay.with_name(replay.name + ".idx")
+
+
+def turn_of(line: bytes, default: int) -> int:
+    # "turn" sits near the end of the payload, look from there
+    at = line.rfind(b'"turn"')
+    match = TURN.match(line, at) if at >= 0 else None
+    return int(match[1]) if match else default
+
+
+def scan(data, start=0, first_line=0) -> np.ndarray:
+    """Index rows of every complete line of `data` from byte `start`"""
+    rows = []
+    offset = start
+    while True:
+        end = data.find(b"\n", offset)
+        if end < 0:
+            break
+
+        line = data[offset:end]
+        if line.strip():
+            rows.append((turn_of(line, first_line + len(rows)), offset, end - offset))
+        offset = end + 1
+
+    return np.array(rows, dtype=ROW)
+
+
+class IndexWriter:
+    """Appends index rows while the replay is being recorded"""
+
+    def __init__(self, replay: Path, offset: int):
+        self.path = index_path(replay)
+        self.offset = offset
+        self.count = 0
+
+        # An index that does not match the replay is rebuilt on the next read
+        if self.covered() != offset:
+            self.path.unlink(missing_ok=True)
+            self.disabled = offset > 0
+        else:
+            self.disabled = False
+
+        self.file = None if self.disabled else self.path.open("ab")
+
+    def covered(self) -> int:
+        if not self.path.is_file():
+            return 0
+        rows = np.fromfile(self.path, dtype=ROW)
+        if len(rows) == 0:
+            return 0
+        return int(rows[-1]["offset"] + rows[-1]["length"] + 1)
+
+    def add(self, line: bytes):
+        """`line` without its newline, exactly as written"""
+        if self.disabled:
+            return
+
+        row = np.array([(turn_of(line, self.count), self.offset, len(line))], ROW)
+        self.file.write(row.tobytes())
+        self.offset += len(line) + 1
+        self.count += 1
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+class TurnIndex:
+    def __init__(self, replay: Path, rows: np.ndarray):
+        self.replay = replay
+        self.rows = rows
+
+        turns = rows["turn"]
+        self.ordered = bool(np.all(turns[1:] >= turns[:-1]))
+
+        self.file = replay.open("rb")
+        size = replay.stat().st_size
+        self.data = (
+            mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+            if size
+            else b""
+        )
+
+    @classmethod
+    def open(cls, replay, save=True) -> "TurnIndex":
+        """
+        Loads the sidecar index, scans whatever it does not cover yet.
+
+        :param save: append the scanned rows to the sidecar, else keep them here
+        """
+        replay = Path(replay)
+        idx = index_path(replay)
+
+        rows = np.fromfile(idx, dtype=ROW) if idx.is_file() else np.empty(0, ROW)
+        covered = int(rows[-1]["offset"] + rows[-1]["length"] + 1) if len(rows) else 0
+
+        size = replay.stat().st_size
+        if covered < size:
+            with replay.open("rb") as f:
+                data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                extra = scan(data, covered, len(rows))
+                data.close()
+
+            if len(extra):
+                if save:
+                    logger.info(f"📇 Indexed {len(extra)} turns of {replay}")
+                    with idx.open("ab") as f:
+                        f.write(extra.tobytes())
+                rows = np.concatenate([rows, extra])
+
+        return cls(replay, rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def position(self, turn: int) -> int:
+        """Line number of the first line at `turn` or later"""
+        turns = self.rows["turn"]
+        if self.ordered:
+            return int(np.searchsorted(turns, turn))
+
+        # Turns restart when a recording spans several rounds
+        later = np.nonzero(turns >= turn)[0]
+        return int(later[0]) if len(later) else len(turns)
+
+    def offset(self, turn: int) -> int:
+        i = self.position(turn)
+        if i >= len(self.rows):
+            return len(self.data)
+        return int(self.rows[i]["offset"])
+
+    def line(self, i: int) -> bytes:
+        row = self.rows[i]
+        start = int(row["offset"])
+        return self.data[start : start + int(row["length"])]
+
+    def raw(self, turn: int) -> bytes:
+        return self.line(self.position(turn))
+
+    def range(self, start: int, stop: int = None):
+        """Raw lines for turns `start` up to `stop` (excluded)"""
+        first = self.position(start)
+        last = len(self.rows) if stop is None else self.position(stop)
+        for i in range(first, last):
+            yield self.line(i)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
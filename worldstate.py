@@ -0,0 +1,198 @@
+"""
+Persistent world model.
+
+The server always sends a full snapshot, `WorldModel.apply` turns it into
+a diff against the previous one and updates live indexes only where
+something changed:
+
+- food by coordinate and by type (golden/suspicious tagging included)
+- occupied cells (fences, our snakes, enemies)
+- snakes by id
+"""
+
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from gt import EnemySnake, Food, Map, Snake, Vec3d
+
+
+@dataclass
+class WorldDiff:
+    turn: int
+
+    food_added: list[Food] = field(default_factory=list)
+    food_removed: list[Vec3d] = field(default_factory=list)
+    food_changed: list[Food] = field(default_factory=list)
+
+    snakes_moved: list[str] = field(default_factory=list)
+    enemies_changed: bool = False
+    fences_changed: bool = False
+
+    def __bool__(self):
+        return bool(
+            self.food_added
+            or self.food_removed
+            or self.food_changed
+            or self.snakes_moved
+            or self.enemies_changed
+            or self.fences_changed
+        )
+
+
+class WorldModel:
+    def __init__(self):
+        self.world: Map = None
+
+        self.food: dict[Vec3d, Food] = {}
+        self.food_by_type: dict[str, set[Vec3d]] = defaultdict(set)
+
+        # cell -> how many things are there
+        self.occupied: Counter[Vec3d] = Counter()
+
+        self.snakes: dict[str, Snake] = {}
+        self.enemies: list[EnemySnake] = []
+        self.fences: list[Vec3d] = []
+
+    #####
+    # Queries
+    ###################################
+
+    def food_at(self, cell: Vec3d) -> Food | None:
+        return self.food.get(cell)
+
+    def foods_of(self, type: str) -> list[Food]:
+        return [self.food[c] for c in self.food_by_type[type]]
+
+    def is_occupied(self, cell: Vec3d) -> bool:
+        return self.occupied[cell] > 0
+
+    def snake(self, id: str) -> Snake | None:
+        return self.snakes.get(id)
+
+    #####
+    # Updates
+    ###################################
+
+    def apply(self, world: Map) -> WorldDiff:
+        diff = WorldDiff(world.turn)
+
+        self._apply_food(world, diff)
+        self._apply_fences(world, diff)
+        self._apply_snakes(world, diff)
+        self._apply_enemies(world, diff)
+
+        self.world = world
+        return diff
+
+    def _occupy(self, cells, sign: int):
+        occupied = self.occupied
+        for cell in cells:
+            occupied[cell] += sign
+            if occupied[cell] <= 0:
+                del occupied[cell]
+
+    def _retype(self, food: Food, type: str):
+        self.food_by_type[food.type].discard(food.coordinate)
+        food.type = type
+        self.food_by_type[type].add(food.coordinate)
+
+    def _apply_food(self, world: Map, diff: WorldDiff):
+        index = self.food
+        seen = set()
+
+        # Read before the loop below retypes the items.
+        # Golden wins over suspicious on the same cell.
+        special = {f.coordinate: "suspicious" for f in world.sus}
+        special.update({f.coordinate: "golden" for f in world.golden})
+
+        for item in world.food:
+            c = item.coordinate
+            seen.add(c)
+
+            old = index.get(c)
+            if old is None:
+                diff.food_added.append(item)
+                item.type = "normal"
+                self.food_by_type["normal"].add(c)
+            else:
+                item.type = old.type
+                if old.points != item.points:
+                    diff.food_changed.append(item)
+
+            index[c] = item
+
+        if len(seen) != len(index):
+            for c in index.keys() - seen:
+                diff.food_removed.append(c)
+                self.food_by_type[index.pop(c).type].discard(c)
+
+        # Special food lists are small, only their changes are applied
+        for type in ("golden", "suspicious"):
+            for c in list(self.food_by_type[type]):
+                if special.get(c) != type:
+                    self._retype(index[c], "normal")
+                    diff.food_changed.append(index[c])
+
+        for c, type in special.items():
+            item = index.get(c)
+            if item is not None and item.type != type:
+                self._retype(item, type)
+                diff.food_changed.append(item)
+
+    def _apply_fences(self, world: Map, diff: WorldDiff):
+        fences = world.fences
+        if fences is self.fences or fences == self.fences:
+            return
+
+        old, new = Counter(self.fences), Counter(fences)
+        self._occupy((old - new).elements(), -1)
+        self._occupy((new - old).elements(), +1)
+
+        self.fences = fences
+        diff.fences_changed = True
+
+    def _apply_snakes(self, world: Map, diff: WorldDiff):
+        alive = set()
+
+        for snake in world.snakes:
+            alive.add(snake.id)
+            old = self.snakes.get(snake.id)
+            self.snakes[snake.id] = snake
+
+            before = old.geometry if old else []
+            after = snake.geometry
+
+            if before == after:
+                continue
+
+            diff.snakes_moved.append(snake.id)
+
+            if before and after and len(before) == len(after):
+                if before[:-1] == after[1:]:
+                    # Plain step, head in, tail out
+                    self._occupy(before[-1:], -1)
+                    self._occupy(after[:1], +1)
+                    continue
+
+            self._occupy(before, -1)
+            self._occupy(after, +1)
+
+        for id in self.snakes.keys() - alive:
+            self._occupy(self.snakes.pop(id).geometry, -1)
+            diff.snakes_moved.append(id)
+
+    def _apply_enemies(self, world: Map, diff: WorldDiff):
+        # Enemies have no ids, compare them as a whole
+        before = [e.geometry for e in self.enemies]
+        after = [e.geometry for e in world.enemies]
+        self.enemies = world.enemies
+
+        if before == after:
+            return
+
+        old = Counter(c for g in before for c in g)
+        new = Counter(c for g in after for c in g)
+        self._occupy((new - old).elements(), +1)
+        self._occupy((old - new).elements(), -1)
+
+        diff.enemies_changed = True